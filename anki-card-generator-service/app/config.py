@@ -5,3 +5,50 @@ load_dotenv()
 
 APP_PORT = int(os.getenv("APP_PORT", 8000))
 ANKI_CONNECT_URL = os.getenv("ANKI_CONNECT_URL", "http://host.docker.internal:8765")
+
+# AnkiConnect HTTP client: timeouts in seconds, sync with AnkiWeb may take a while
+ANKI_CONNECT_TIMEOUT = float(os.getenv("ANKI_CONNECT_TIMEOUT", 120))
+ANKI_CONNECT_CONNECT_TIMEOUT = float(os.getenv("ANKI_CONNECT_CONNECT_TIMEOUT", 5))
+ANKI_CONNECT_MAX_CONNECTIONS = int(os.getenv("ANKI_CONNECT_MAX_CONNECTIONS", 10))
+ANKI_CONNECT_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("ANKI_CONNECT_MAX_KEEPALIVE_CONNECTIONS", 5))
+
+# AnkiWeb sync requests arriving within this window are coalesced into one sync
+ANKI_SYNC_DEBOUNCE_SECONDS = float(os.getenv("ANKI_SYNC_DEBOUNCE_SECONDS", 10))
+
+# Media downloads for content hashing use their own pool, so they never hold up AnkiConnect calls
+MEDIA_DOWNLOAD_TIMEOUT = float(os.getenv("MEDIA_DOWNLOAD_TIMEOUT", 30))
+MEDIA_DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("MEDIA_DOWNLOAD_MAX_CONNECTIONS", 10))
+# Downloaded media up to this size is kept in memory until it is stored in Anki, larger files go to disk
+MEDIA_SPOOL_MAX_BYTES = int(os.getenv("MEDIA_SPOOL_MAX_BYTES", 1024 * 1024))
+
+# Deck and model names are cached for this many seconds, 0 disables the cache
+ANKI_METADATA_CACHE_TTL = float(os.getenv("ANKI_METADATA_CACHE_TTL", 300))
+
+# Bulk import: number of rows turned into notes per addNotes round trip
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 50))
+# A CSV record may span lines inside quotes up to this many characters, a stray quote
+# otherwise swallows the rest of the file
+IMPORT_MAX_RECORD_CHARS = int(os.getenv("IMPORT_MAX_RECORD_CHARS", 64 * 1024))
+
+# Offline .apkg builder: concurrent media downloads per package
+APKG_MEDIA_DOWNLOAD_CONCURRENCY = int(os.getenv("APKG_MEDIA_DOWNLOAD_CONCURRENCY", 8))
+# Card templates of the AllInOne note type: front.html, back.html and style.css. Point it at
+# a copy of the add-on's templates to get its look in packaged decks
+APKG_ALL_IN_ONE_TEMPLATE_DIR = os.getenv(
+    "APKG_ALL_IN_ONE_TEMPLATE_DIR", os.path.join(os.path.dirname(__file__), "templates", "all_in_one")
+)
+
+# Outbox: card requests are persisted here and drained into Anki by background workers
+OUTBOX_DB_PATH = os.getenv("OUTBOX_DB_PATH", "outbox.sqlite3")
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 2))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 10))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", 5))
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", 600))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", 5))
+# Finished jobs are kept for status lookups this long
+OUTBOX_RETENTION_SECONDS = float(os.getenv("OUTBOX_RETENTION_SECONDS", 7 * 24 * 3600))
+
+# Duplicate phrase detection: storage-service keeps every phrase cards were made for, empty URL disables it
+STORAGE_SERVICE_URL = os.getenv("STORAGE_SERVICE_URL", "http://storage:8000")
+# Each source gets this long, an unavailable one is skipped so card requests are never held up
+DEDUPE_TIMEOUT = float(os.getenv("DEDUPE_TIMEOUT", 1))
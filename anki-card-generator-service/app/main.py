@@ -1,65 +1,310 @@
-from fastapi import FastAPI, HTTPException, Depends
-from .schemas import CardRequest
-from .services.anki_connect_service import AnkiConnectService
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Query
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from .schemas import CardRequest, SyncStatus, JobStatus, PhraseLookup
+from .services.anki_connect_service import (
+    AnkiConnectService,
+    create_http_client,
+    METADATA_DECK_NAMES,
+    METADATA_MODEL_NAMES,
+)
+from .services.sync_scheduler_service import SyncScheduler
+from .services.outbox_service import OutboxQueue, OutboxWorker, PermanentJobError, JobContext
+from .services.phrase_dedupe_service import PhraseDedupeService, create_storage_client
+from .services.apkg_builder_service import ApkgPackageBuilder, build_package
 from .services.card_generator_service import card_factory
+from .services.card_import_service import (
+    CardImportService,
+    iter_records,
+    iter_upload,
+    IMPORT_FORMAT_CSV,
+    IMPORT_FORMAT_JSONL,
+)
 from .config import APP_PORT
 import traceback
 import logging
+import json
+import httpx
+from typing import Any, Dict, List
 
 logger = logging.getLogger(__name__)
 
+REQUIRED_MODELS = ["AllInOne (kprim, mc, sc)", "Basic", "Basic (and reversed card)"]
+
 app = FastAPI()
 
+anki_connect_service: AnkiConnectService = None
+sync_scheduler: SyncScheduler = None
+outbox_worker: OutboxWorker = None
+phrase_dedupe_service: PhraseDedupeService = None
+
+@app.on_event("startup")
+async def on_startup():
+    """
+    Opens the AnkiConnect connection pool shared by all requests
+    and starts draining the card outbox.
+    """
+    global anki_connect_service, sync_scheduler, outbox_worker, phrase_dedupe_service
+    anki_connect_service = AnkiConnectService(create_http_client())
+    sync_scheduler = SyncScheduler(anki_connect_service)
+    phrase_dedupe_service = PhraseDedupeService(create_storage_client(), anki_connect_service)
+    outbox_worker = OutboxWorker(OutboxQueue(), add_cards)
+    await outbox_worker.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await outbox_worker.stop()
+    outbox_worker.queue.close()
+    await sync_scheduler.close()
+    await phrase_dedupe_service.client.aclose()
+    await anki_connect_service.close()
+
 def get_anki_connect_service():
-    return AnkiConnectService()
+    return anki_connect_service
+
+def get_sync_scheduler():
+    return sync_scheduler
+
+def get_outbox_worker():
+    return outbox_worker
+
+def get_phrase_dedupe_service():
+    return phrase_dedupe_service
+
+async def check_required_models(anki_service: AnkiConnectService) -> None:
+    available_models = await anki_service.get_model_names()
+    # Cached names might miss a freshly installed model
+    if not set(REQUIRED_MODELS).issubset(available_models):
+        anki_service.invalidate_metadata(METADATA_MODEL_NAMES)
+        available_models = await anki_service.get_model_names()
+    for model in REQUIRED_MODELS:
+        if model not in available_models:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Anki model '{model}' not found. Please ensure it is installed."
+            )
 
 @app.get("/decks")
-async def get_deck_names(anki_service: AnkiConnectService = Depends(get_anki_connect_service)):
+async def get_deck_names(
+    sync: bool = False,
+    anki_service: AnkiConnectService = Depends(get_anki_connect_service),
+    scheduler: SyncScheduler = Depends(get_sync_scheduler)
+):
     try:
-        anki_service.sync()
-        return anki_service.get_deck_names()
+        if sync:
+            await scheduler.sync_now()
+        else:
+            scheduler.request_sync()
+        return await anki_service.get_deck_names()
     except Exception as e:
         stack_trace_string = traceback.format_exc()
         logger.error(f"Error adding cards: {str(e)} {stack_trace_string}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/generate-cards")
+async def add_cards(payload: Dict[str, Any], context: JobContext) -> Dict[str, Any]:
+    """
+    Outbox job handler: generates the notes of a queued CardRequest and adds them to Anki.
+
+    The ids of added notes are saved with the job, a retry after a later
+    step failed does not add the notes again.
+    """
+    request = CardRequest(**payload)
+    anki_service = anki_connect_service
+    added_notes_ids = context.progress.get("added_notes_ids")
+    if added_notes_ids is None:
+        added_notes_ids = await add_notes(request, anki_service)
+        await context.save(added_notes_ids=added_notes_ids)
+    await phrase_dedupe_service.remember(request.source_lang_sentence)
+
+    if request.sync_now:
+        sync_status = await sync_scheduler.sync_now()
+    else:
+        sync_scheduler.request_sync()
+        sync_status = sync_scheduler.get_status()
+
+    return {
+        "added_notes_ids": added_notes_ids,
+        "sync": sync_status.model_dump(mode="json")
+    }
+
+async def add_notes(request: CardRequest, anki_service: AnkiConnectService) -> List[int]:
+    deck_names, _ = await anki_service.get_metadata(METADATA_DECK_NAMES, METADATA_MODEL_NAMES)
+
+    # Check if deck exists, create if not
+    if request.deck_name not in deck_names:
+        await anki_service.create_deck(request.deck_name)
+
+    try:
+        await check_required_models(anki_service)
+    except HTTPException as e:
+        raise PermanentJobError(e.detail)
+
+    # Generators name their media files concurrently, media and notes go to Anki in batched calls
+    batch = anki_service.batch()
+    notes = await card_factory.create_all_notes(request, batch)
+    # Duplicates are decided by phrase before the request is queued. Anki's own check compares
+    # first fields, which for AllInOne notes is the translation shared by different phrases
+    for note in notes:
+        note["options"] = {"allowDuplicate": True}
+    notes_index = batch.add("addNotes", notes=notes)
+    return (await batch.execute())[notes_index]
+
+@app.post("/generate-cards", status_code=202)
 async def generate_cards(
     request: CardRequest,
-    anki_service: AnkiConnectService = Depends(get_anki_connect_service)
+    worker: OutboxWorker = Depends(get_outbox_worker),
+    dedupe_service: PhraseDedupeService = Depends(get_phrase_dedupe_service)
 ):
-    try:
-        # Check if deck exists, create if not
-        if request.deck_name not in anki_service.get_deck_names():
-            anki_service.create_deck(request.deck_name)
-
-        # Check for required models
-        available_models = anki_service.get_model_names()
-        required_models = ["AllInOne (kprim, mc, sc)", "Basic", "Basic (and reversed card)"]
-        for model in required_models:
-            if model not in available_models:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Anki model '{model}' not found. Please ensure it is installed."
-                )
-
-        notes = card_factory.create_all_notes(request, anki_service)
-        added_notes_ids = []
-        for note in notes:
-            note_id = anki_service.add_note(note)
-            added_notes_ids.append(note_id)
-
-        anki_service.sync()
+    """
+    Queues a card request, the cards are added to Anki in the background.
 
+    Requests survive restarts and Anki being offline, failed attempts are retried.
+    Use /jobs/{job_id} to follow the job. Phrases that already have cards are
+    rejected with 409 unless allowDuplicate is set.
+    """
+    if not request.allow_duplicate:
+        lookup = await dedupe_service.lookup(request.source_lang_sentence, request.deck_name)
+        if lookup.duplicate:
+            raise HTTPException(status_code=409, detail=lookup.model_dump())
+    try:
+        job_id = await worker.enqueue(request.model_dump(by_alias=True))
         return {
-            "message": "Cards generated and synced successfully!",
-            "added_notes_ids": added_notes_ids
+            "message": "Cards are queued!",
+            "job_id": job_id
         }
     except Exception as e:
         stack_trace_string = traceback.format_exc()
-        logger.error(f"Error adding cards: {str(e)} {stack_trace_string}")
+        logger.error(f"Error queueing cards: {str(e)} {stack_trace_string}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/phrases/lookup", response_model=PhraseLookup)
+async def lookup_phrase(
+    text: str,
+    deck_name: str = Query(None, alias="deckName"),
+    dedupe_service: PhraseDedupeService = Depends(get_phrase_dedupe_service)
+):
+    """
+    Tells whether cards were already made for a phrase, before any work is spent on it.
+    """
+    return await dedupe_service.lookup(text, deck_name)
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str, worker: OutboxWorker = Depends(get_outbox_worker)):
+    job = await worker.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/jobs")
+async def get_jobs_stats(worker: OutboxWorker = Depends(get_outbox_worker)):
+    return await worker.stats()
+
+@app.post("/generate-cards/batch")
+async def generate_cards_batch(
+    file: UploadFile = File(..., description="CSV or JSONL file with CardRequest rows."),
+    format: str = None,
+    anki_service: AnkiConnectService = Depends(get_anki_connect_service),
+    scheduler: SyncScheduler = Depends(get_sync_scheduler)
+):
+    """
+    Imports a CSV or JSONL stream of CardRequest rows.
+
+    CSV files need a header with CardRequest field aliases, generated options are
+    separated with '|'. The format is taken from the 'format' parameter or the
+    file extension. Progress is streamed back as JSON lines, one per row,
+    followed by a summary. Anki is synced once at the end.
+    """
+    import_format = format or (IMPORT_FORMAT_CSV if (file.filename or "").endswith(".csv") else IMPORT_FORMAT_JSONL)
+    if import_format not in (IMPORT_FORMAT_CSV, IMPORT_FORMAT_JSONL):
+        raise HTTPException(status_code=400, detail=f"Unsupported import format: {import_format}")
+    await check_required_models(anki_service)
+
+    import_service = CardImportService(anki_service)
+
+    async def progress_lines():
+        added = failed = 0
+        try:
+            async for progress in import_service.import_cards(iter_records(iter_upload(file), import_format)):
+                if progress["status"] == "added":
+                    added += 1
+                else:
+                    failed += 1
+                yield json.dumps(progress) + "\n"
+        except Exception as e:
+            stack_trace_string = traceback.format_exc()
+            logger.error(f"Error importing cards: {str(e)} {stack_trace_string}")
+            yield json.dumps({"status": "error", "error": str(e)}) + "\n"
+        sync_status = await scheduler.sync_now() if added else scheduler.get_status()
+        yield json.dumps({
+            "status": "done",
+            "added": added,
+            "failed": failed,
+            "sync": sync_status.model_dump(mode="json")
+        }) + "\n"
+
+    return StreamingResponse(progress_lines(), media_type="application/x-ndjson")
+
+@app.post("/generate-cards/apkg")
+async def generate_cards_apkg(
+    file: UploadFile = File(..., description="CSV or JSONL file with CardRequest rows."),
+    format: str = None
+):
+    """
+    Builds a self-contained .apkg package from a CSV or JSONL file of CardRequest rows.
+
+    Accepts the same files as /generate-cards/batch, but needs no running Anki:
+    media files are downloaded and bundled into the package, which can then be
+    imported in one step. Rows that could not be converted are listed in the
+    X-Failed-Rows header. AllInOne notes use the templates in
+    APKG_ALL_IN_ONE_TEMPLATE_DIR, notes of unknown note types are left out and
+    counted in the X-Skipped-Notes header.
+    """
+    import_format = format or (IMPORT_FORMAT_CSV if (file.filename or "").endswith(".csv") else IMPORT_FORMAT_JSONL)
+    if import_format not in (IMPORT_FORMAT_CSV, IMPORT_FORMAT_JSONL):
+        raise HTTPException(status_code=400, detail=f"Unsupported import format: {import_format}")
+
+    async with httpx.AsyncClient(timeout=60) as client:
+        builder = ApkgPackageBuilder(client)
+        try:
+            summary = await build_package(builder, iter_records(iter_upload(file), import_format))
+            package_path = await run_in_threadpool(builder.write)
+        except Exception as e:
+            builder.cleanup()
+            stack_trace_string = traceback.format_exc()
+            logger.error(f"Error building package: {str(e)} {stack_trace_string}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return FileResponse(
+        package_path,
+        media_type="application/octet-stream",
+        filename="cards.apkg",
+        headers={
+            "X-Notes-Count": str(summary["notes"]),
+            "X-Skipped-Notes": str(summary["skipped_notes"]),
+            "X-Failed-Rows": ",".join(map(str, summary["failed_rows"]))
+        },
+        background=BackgroundTask(builder.cleanup)
+    )
+
+@app.get("/sync", response_model=SyncStatus)
+async def get_sync_status(scheduler: SyncScheduler = Depends(get_sync_scheduler)):
+    return scheduler.get_status()
+
+@app.post("/sync", response_model=SyncStatus)
+async def sync_now(scheduler: SyncScheduler = Depends(get_sync_scheduler)):
+    return await scheduler.sync_now()
+
+@app.get("/stats")
+async def get_stats(
+    anki_service: AnkiConnectService = Depends(get_anki_connect_service),
+    worker: OutboxWorker = Depends(get_outbox_worker)
+):
+    return {
+        "metadata_cache": anki_service.metadata_cache.stats(),
+        "outbox": await worker.stats()
+    }
+
 @app.get("/health")
 def get_health():
     return "OK"
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import Any, Dict, List, Optional
+from datetime import datetime
 
 class CardRequest(BaseModel):
     deck_name: str = Field(..., alias="deckName")
@@ -9,3 +10,33 @@ class CardRequest(BaseModel):
     audio_url: str = Field(..., alias="audioUrl")
     generated_options: List[str] = Field(..., alias="generatedOptions")
     cloze_sentence: str = Field(..., alias="clozeSentence")
+    sync_now: bool = Field(False, alias="syncNow")
+    allow_duplicate: bool = Field(False, alias="allowDuplicate")
+
+class SyncStatus(BaseModel):
+    status: str
+    pending: bool
+    last_started_at: Optional[datetime] = None
+    last_finished_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    requested: int
+    completed: int
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    attempts: int
+    created_at: datetime
+    updated_at: datetime
+    next_attempt_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+    result: Optional[Any] = None
+
+class PhraseLookup(BaseModel):
+    text: str
+    normalized: str
+    duplicate: bool
+    phrase_ids: List[int] = []
+    anki_note_ids: List[int] = []
+    errors: Dict[str, str] = {}
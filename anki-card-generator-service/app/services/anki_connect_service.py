@@ -1,37 +1,322 @@
-import requests
-from ..config import ANKI_CONNECT_URL
-from typing import Dict, Any, List
+import base64
+import hashlib
+import httpx
+import tempfile
+import time
+from ..config import (
+    ANKI_CONNECT_URL,
+    ANKI_CONNECT_TIMEOUT,
+    ANKI_CONNECT_CONNECT_TIMEOUT,
+    ANKI_CONNECT_MAX_CONNECTIONS,
+    ANKI_CONNECT_MAX_KEEPALIVE_CONNECTIONS,
+    ANKI_METADATA_CACHE_TTL,
+    MEDIA_DOWNLOAD_TIMEOUT,
+    MEDIA_DOWNLOAD_MAX_CONNECTIONS,
+    MEDIA_SPOOL_MAX_BYTES,
+)
+from typing import BinaryIO, Dict, Any, List, Optional, Tuple
+
+ANKI_CONNECT_VERSION = 6
+
+METADATA_DECK_NAMES = "deckNames"
+METADATA_MODEL_NAMES = "modelNames"
+
+# AnkiConnect reports unknown decks and models as e.g. "model was not found: Basic"
+STALE_METADATA_ERRORS = {
+    "deck was not found": METADATA_DECK_NAMES,
+    "model was not found": METADATA_MODEL_NAMES,
+}
+
+
+class AnkiConnectError(Exception):
+    def __init__(self, error: str, action: Optional[str] = None):
+        self.error = error
+        self.action = action
+        if action:
+            super().__init__(f"AnkiConnect error in '{action}': {error}")
+        else:
+            super().__init__(f"AnkiConnect error: {error}")
+
+
+class AnkiConnectBatch:
+    """
+    Collects AnkiConnect actions and executes them in a single 'multi' request.
+
+    Serves as the media store of card generators: media files are downloaded
+    and named after their content when queued, and stored together before the
+    other actions run.
+    """
+
+    def __init__(self, anki_service: "AnkiConnectService"):
+        self.anki_service = anki_service
+        self._actions: List[Dict[str, Any]] = []
+        # Content-hash file name -> downloaded content
+        self._media: Dict[str, BinaryIO] = {}
+
+    def add(self, action: str, **params) -> int:
+        """Queues an action and returns the index of its result."""
+        self._actions.append(_action(action, **params))
+        return len(self._actions) - 1
+
+    async def store_media_from_url(self, url: str, extension: str) -> str:
+        """
+        Queues a media file under a name derived from its content and returns the name.
+
+        The same content always gets the same name, so a file that Anki already
+        has is not stored again.
+        """
+        filename, file = await self.anki_service.download_media_file(url, extension)
+        if filename in self._media:
+            file.close()
+        else:
+            self._media[filename] = file
+        return filename
+
+    async def execute(self) -> List[Any]:
+        """
+        Returns the result of every action in order.
+
+        Queued media files are stored first, with one request checking which of
+        them Anki already has and one storing the rest. Raises AnkiConnectError
+        naming the first action that failed.
+        """
+        await self._store_media()
+        if not self._actions:
+            return []
+        return await self.anki_service.multi(self._actions)
+
+    async def _store_media(self) -> None:
+        if not self._media:
+            return
+        try:
+            filenames = list(self._media)
+            existing = await self.anki_service.multi(
+                [_action("getMediaFilesNames", pattern=filename) for filename in filenames]
+            )
+            missing = [filename for filename, names in zip(filenames, existing) if filename not in names]
+            if missing:
+                # The content was downloaded for hashing already, so it is sent along instead of
+                # letting AnkiConnect download it a second time
+                await self.anki_service.multi(
+                    [_action("storeMediaFile", filename=filename, data=_read_base64(self._media[filename]))
+                     for filename in missing]
+                )
+        finally:
+            for file in self._media.values():
+                file.close()
+            self._media.clear()
+
+
+class MetadataCache:
+    """Keeps results of parameterless metadata actions for a limited time."""
+
+    def __init__(self, ttl_seconds: float = ANKI_METADATA_CACHE_TTL):
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl_seconds:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic(), value)
+
+    def invalidate(self, key: Optional[str] = None) -> None:
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": {
+                key: round(now - stored_at, 3)
+                for key, (stored_at, _) in self._entries.items()
+                if now - stored_at < self.ttl_seconds
+            },
+        }
+
+
+def _read_base64(file: BinaryIO) -> str:
+    file.seek(0)
+    return base64.b64encode(file.read()).decode("ascii")
+
+
+def _action(action: str, **params) -> Dict[str, Any]:
+    return {"action": action, "version": ANKI_CONNECT_VERSION, "params": params}
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Creates the keep-alive connection pool shared by all AnkiConnect calls."""
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(ANKI_CONNECT_TIMEOUT, connect=ANKI_CONNECT_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=ANKI_CONNECT_MAX_CONNECTIONS,
+            max_keepalive_connections=ANKI_CONNECT_MAX_KEEPALIVE_CONNECTIONS,
+        ),
+    )
+
+
+def create_media_client() -> httpx.AsyncClient:
+    """Creates the connection pool media files are downloaded with to name them after their content."""
+    return httpx.AsyncClient(
+        # Downloads queue for a free connection instead of failing on the pool timeout
+        timeout=httpx.Timeout(MEDIA_DOWNLOAD_TIMEOUT, pool=None),
+        limits=httpx.Limits(max_connections=MEDIA_DOWNLOAD_MAX_CONNECTIONS),
+    )
+
+
+async def download_media(client: httpx.AsyncClient, url: str, extension: str,
+                         file: Optional[BinaryIO] = None) -> str:
+    """
+    Streams a media file, optionally into `file`, and returns its content-hash name.
+
+    The content is hashed chunk by chunk and never held in memory as a whole.
+    """
+    digest = hashlib.sha256()
+    async with client.stream("GET", url, follow_redirects=True) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            digest.update(chunk)
+            if file is not None:
+                file.write(chunk)
+    return f"{digest.hexdigest()}{extension}"
+
 
 class AnkiConnectService:
-    def __init__(self, url: str = ANKI_CONNECT_URL):
+    def __init__(self, client: httpx.AsyncClient, url: str = ANKI_CONNECT_URL,
+                 metadata_cache: Optional[MetadataCache] = None,
+                 media_client: Optional[httpx.AsyncClient] = None):
+        self.client = client
         self.url = url
+        self.metadata_cache = metadata_cache or MetadataCache()
+        self.media_client = media_client or create_media_client()
 
-    def _invoke(self, action: str, **params) -> Dict[str, Any]:
-        payload = {"action": action, "version": 6, "params": params}
+    async def _invoke(self, action: str, **params) -> Any:
+        payload = _action(action, **params)
         try:
-            response = requests.post(self.url, json=payload)
+            response = await self.client.post(self.url, json=payload)
             response.raise_for_status()
             result = response.json()
             if result.get("error"):
-                raise Exception(f"AnkiConnect error: {result['error']}")
+                raise self._on_error(AnkiConnectError(result["error"]))
             return result["result"]
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise Exception(f"Failed to connect to AnkiConnect: {e}")
 
-    def add_note(self, note: Dict[str, Any]) -> int:
-        return self._invoke("addNote", note=note)
+    def _on_error(self, error: AnkiConnectError) -> AnkiConnectError:
+        # An unknown deck or model means the cached names are out of date
+        for message, key in STALE_METADATA_ERRORS.items():
+            if message in str(error.error):
+                self.metadata_cache.invalidate(key)
+        return error
+
+    async def close(self) -> None:
+        await self.client.aclose()
+        await self.media_client.aclose()
+
+    def batch(self) -> AnkiConnectBatch:
+        return AnkiConnectBatch(self)
+
+    async def multi(self, actions: List[Dict[str, Any]]) -> List[Any]:
+        """
+        Executes several actions in one round trip.
+
+        Returns the result of every action in order. Raises AnkiConnectError
+        naming the first action that failed.
+        """
+        results = await self._invoke("multi", actions=actions)
+        mapped_results = []
+        for action, result in zip(actions, results):
+            try:
+                mapped_results.append(_unwrap_result(action, result))
+            except AnkiConnectError as e:
+                raise self._on_error(e)
+        return mapped_results
 
-    def sync(self) -> None:
-        self._invoke("sync")
+    async def get_metadata(self, *keys: str) -> List[Any]:
+        """
+        Returns the results of metadata actions such as deckNames and modelNames.
+
+        Cached results are reused, all missing ones are fetched in a single round trip.
+        """
+        values = {key: self.metadata_cache.get(key) for key in keys}
+        missing = [key for key, value in values.items() if value is None]
+        if len(missing) == 1:
+            fetched = [await self._invoke(missing[0])]
+        elif missing:
+            fetched = await self.multi([_action(key) for key in missing])
+        else:
+            fetched = []
+        for key, value in zip(missing, fetched):
+            self.metadata_cache.put(key, value)
+            values[key] = value
+        return [values[key] for key in keys]
+
+    def invalidate_metadata(self, key: Optional[str] = None) -> None:
+        self.metadata_cache.invalidate(key)
+
+    async def add_note(self, note: Dict[str, Any]) -> int:
+        return await self._invoke("addNote", note=note)
+
+    async def add_notes(self, notes: List[Dict[str, Any]]) -> List[int]:
+        note_ids = await self._invoke("addNotes", notes=notes)
+        return _check_note_ids("addNotes", notes, note_ids)
+
+    async def find_notes(self, query: str) -> List[int]:
+        return await self._invoke("findNotes", query=query)
+
+    async def sync(self) -> None:
+        await self._invoke("sync")
+
+    async def get_deck_names(self) -> List[str]:
+        return (await self.get_metadata(METADATA_DECK_NAMES))[0]
+
+    async def get_model_names(self) -> List[str]:
+        return (await self.get_metadata(METADATA_MODEL_NAMES))[0]
+
+    async def create_deck(self, deck: str) -> int:
+        deck_id = await self._invoke("createDeck", deck=deck)
+        self.metadata_cache.invalidate(METADATA_DECK_NAMES)
+        return deck_id
+
+    async def store_media_file_from_url(self, filename: str, url: str) -> str:
+        return await self._invoke("storeMediaFile", filename=filename, url=url)
+
+    async def download_media_file(self, url: str, extension: str) -> Tuple[str, BinaryIO]:
+        """Downloads a media file, returns its content-hash name and a file holding the content."""
+        file = tempfile.SpooledTemporaryFile(max_size=MEDIA_SPOOL_MAX_BYTES)
+        try:
+            return await download_media(self.media_client, url, extension, file), file
+        except BaseException:
+            file.close()
+            raise
 
-    def get_deck_names(self) -> List[str]:
-        return self._invoke("deckNames")
 
-    def get_model_names(self) -> List[str]:
-        return self._invoke("modelNames")
+def _unwrap_result(action: Dict[str, Any], result: Any) -> Any:
+    # Versioned actions inside 'multi' come back as {"result": ..., "error": ...}
+    if isinstance(result, dict) and set(result.keys()) == {"result", "error"}:
+        if result["error"]:
+            raise AnkiConnectError(result["error"], action["action"])
+        result = result["result"]
+    if action["action"] == "addNotes":
+        return _check_note_ids("addNotes", action["params"]["notes"], result)
+    return result
 
-    def create_deck(self, deck: str) -> int:
-        return self._invoke("createDeck", deck=deck)
 
-    def store_media_file_from_url(self, filename: str, url: str) -> str:
-        return self._invoke("storeMediaFile", filename=filename, url=url)
+def _check_note_ids(action: str, notes: List[Dict[str, Any]], note_ids: List[Optional[int]]) -> List[int]:
+    # Older AnkiConnect versions report rejected notes as null ids
+    failed = [note["modelName"] for note, note_id in zip(notes, note_ids) if note_id is None]
+    if failed:
+        raise AnkiConnectError(f"failed to add notes of models {failed}", action)
+    return note_ids
@@ -0,0 +1,165 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import AsyncIterator, Dict, Any, List, Tuple
+
+import genanki
+import httpx
+
+from pydantic import ValidationError
+
+from .anki_connect_service import download_media
+from .card_generator_service import CardFactory, card_factory
+from ..config import APKG_ALL_IN_ONE_TEMPLATE_DIR, APKG_MEDIA_DOWNLOAD_CONCURRENCY, IMPORT_CHUNK_SIZE
+from ..schemas import CardRequest
+
+# Fixed id, so every package adds to the same AllInOne note type instead of creating a new one
+ALL_IN_ONE_MODEL_ID = 1_566_095_810
+ALL_IN_ONE_FIELDS = ["Question", "Title", "QType", "Q_1", "Q_2", "Q_3", "Q_4", "Q_5", "Answers", "Sources", "Extra 1"]
+
+
+def load_all_in_one_model(template_dir: str = APKG_ALL_IN_ONE_TEMPLATE_DIR) -> genanki.Model:
+    """Builds the AllInOne multiple choice note type with the field set of the add-on."""
+    def read(name: str) -> str:
+        with open(os.path.join(template_dir, name), encoding="utf-8") as f:
+            return f.read()
+
+    return genanki.Model(
+        ALL_IN_ONE_MODEL_ID,
+        "AllInOne (kprim, mc, sc)",
+        fields=[{"name": name} for name in ALL_IN_ONE_FIELDS],
+        templates=[{"name": "AllInOne", "qfmt": read("front.html"), "afmt": read("back.html")}],
+        css=read("style.css"),
+    )
+
+
+# genanki's stock note types and AllInOne, imports reuse them instead of creating a new note type every time
+APKG_MODELS = {
+    "AllInOne (kprim, mc, sc)": load_all_in_one_model(),
+    "Basic": genanki.builtin_models.BASIC_MODEL,
+    "Basic (and reversed card)": genanki.builtin_models.BASIC_AND_REVERSED_CARD_MODEL,
+    "Cloze": genanki.builtin_models.CLOZE_MODEL,
+}
+
+
+class ApkgMediaStore:
+    """
+    Downloads media files into a local directory instead of the Anki media folder.
+
+    Serves as the media store of card generators, so they can be used without
+    a running Anki.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, media_dir: str,
+                 concurrency: int = APKG_MEDIA_DOWNLOAD_CONCURRENCY):
+        self.client = client
+        self.media_dir = media_dir
+        self.media_files: List[str] = []
+        self._media_paths = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def store_media_from_url(self, url: str, extension: str) -> str:
+        # Streamed to a temporary file and hashed on the way, then renamed after its content
+        with tempfile.NamedTemporaryFile(dir=self.media_dir, suffix=".part", delete=False) as f:
+            try:
+                async with self._semaphore:
+                    filename = await download_media(self.client, url, extension, f)
+            except BaseException:
+                f.close()
+                os.remove(f.name)
+                raise
+        file_path = os.path.join(self.media_dir, filename)
+        # Media reused by several notes is bundled once
+        if file_path in self._media_paths:
+            os.remove(f.name)
+        else:
+            os.replace(f.name, file_path)
+            self._media_paths.add(file_path)
+            self.media_files.append(file_path)
+        return filename
+
+
+class ApkgPackageBuilder:
+    """
+    Collects notes produced by CardFactory and writes them as one .apkg package.
+
+    Notes use the AnkiConnect format, every deck they mention becomes a deck of
+    the package. Media files are written to a temporary directory and bundled
+    with the package.
+    """
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.work_dir = tempfile.mkdtemp(prefix="apkg-")
+        self.media_store = ApkgMediaStore(client, os.path.join(self.work_dir, "media"))
+        os.makedirs(self.media_store.media_dir)
+        self._decks: Dict[str, genanki.Deck] = {}
+        self.notes_count = 0
+        self.skipped_notes = 0
+
+    def add_notes(self, notes: List[Dict[str, Any]]) -> None:
+        """
+        Adds notes of the models in APKG_MODELS.
+
+        Notes of any other model are left out and counted in skipped_notes.
+        """
+        for note in notes:
+            model = APKG_MODELS.get(note["modelName"])
+            if model is None:
+                self.skipped_notes += 1
+                continue
+            fields = [note["fields"].get(field["name"], "") for field in model.fields]
+            self._deck(note["deckName"]).add_note(genanki.Note(model=model, fields=fields, tags=note.get("tags", [])))
+            self.notes_count += 1
+
+    def write(self) -> str:
+        """Writes the package and returns its path."""
+        package_path = os.path.join(self.work_dir, "cards.apkg")
+        package = genanki.Package(list(self._decks.values()), media_files=self.media_store.media_files)
+        package.write_to_file(package_path)
+        return package_path
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _deck(self, deck_name: str) -> genanki.Deck:
+        if deck_name not in self._decks:
+            # Same deck name, same deck id: importing merges into an existing deck
+            deck_id = (1 << 30) + int(hashlib.sha1(deck_name.encode("utf-8")).hexdigest()[:8], 16) % (1 << 30)
+            self._decks[deck_name] = genanki.Deck(deck_id, deck_name)
+        return self._decks[deck_name]
+
+
+async def build_package(builder: ApkgPackageBuilder, records: AsyncIterator[Tuple[int, Any]],
+                        factory: CardFactory = card_factory, chunk_size: int = IMPORT_CHUNK_SIZE) -> Dict[str, Any]:
+    """Runs the card generators for every record and adds the notes to the package."""
+    failed_rows: List[int] = []
+    chunk: List[Tuple[int, CardRequest]] = []
+
+    async def add_chunk():
+        chunk_notes = await asyncio.gather(
+            *[factory.create_all_notes(request, builder.media_store) for _, request in chunk],
+            return_exceptions=True
+        )
+        for (row_number, _), notes in zip(chunk, chunk_notes):
+            if isinstance(notes, Exception):
+                failed_rows.append(row_number)
+            else:
+                builder.add_notes(notes)
+        chunk.clear()
+
+    async for row_number, record in records:
+        try:
+            if isinstance(record, Exception):
+                raise record
+            chunk.append((row_number, CardRequest(**record)))
+        except (ValidationError, ValueError, TypeError):
+            failed_rows.append(row_number)
+            continue
+        if len(chunk) >= chunk_size:
+            await add_chunk()
+    if chunk:
+        await add_chunk()
+
+    return {"notes": builder.notes_count, "skipped_notes": builder.skipped_notes, "failed_rows": sorted(failed_rows)}
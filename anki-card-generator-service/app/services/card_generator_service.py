@@ -1,9 +1,8 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional
-import uuid
+import asyncio
+from typing import Dict, Any, List, Optional, Protocol
 import os
 
-from .anki_connect_service import AnkiConnectService
 from ..schemas import CardRequest
 
 STORAGE_MODE_ANKI = "ANKI"
@@ -11,9 +10,20 @@ STORAGE_MODE_URL = "URL"
 
 STORAGE_MODE = os.getenv("STORAGE_MODE", STORAGE_MODE_ANKI)
 
+class MediaStore(Protocol):
+    """
+    Where generators put the media of their notes, e.g. an AnkiConnectBatch or
+    the media folder of an .apkg package.
+    """
+
+    async def store_media_from_url(self, url: str, extension: str) -> str:
+        """Stores the file behind the URL and returns the name notes refer to it by."""
+        ...
+
+
 class CardGenerator(ABC):
     @abstractmethod
-    def create_note(self, data: CardRequest, anki_service: Optional[AnkiConnectService] = None) -> Dict[str, Any]:
+    async def create_note(self, data: CardRequest, media_store: Optional[MediaStore] = None) -> Dict[str, Any]:
         pass
 
     def available(self) -> bool:
@@ -21,7 +31,7 @@ class CardGenerator(ABC):
 
 
 class ClozeDeletionGenerator(CardGenerator):
-    def create_note(self, data: CardRequest, anki_service: Optional[AnkiConnectService] = None) -> Dict[str, Any]:
+    async def create_note(self, data: CardRequest, media_store: Optional[MediaStore] = None) -> Dict[str, Any]:
         return {
             "deckName": data.deck_name,
             "modelName": "Cloze",
@@ -32,7 +42,7 @@ class ClozeDeletionGenerator(CardGenerator):
 
 
 class AllInOneCardGenerator(CardGenerator):
-    def create_note(self, data: CardRequest, anki_service: Optional[AnkiConnectService] = None) -> Dict[str, Any]:
+    async def create_note(self, data: CardRequest, media_store: Optional[MediaStore] = None) -> Dict[str, Any]:
         options = [data.source_lang_sentence] + data.generated_options
         q_fields = {f"Q_{i+1}": option for i, option in enumerate(options)}
 
@@ -51,14 +61,13 @@ class AllInOneCardGenerator(CardGenerator):
 
 
 class BasicAudioCardGeneratorAnki(CardGenerator):
-    def create_note(self, data: CardRequest, anki_service: Optional[AnkiConnectService] = None) -> Dict[str, Any]:
-        if not anki_service:
-            raise ValueError("AnkiConnectService is required for BasicAudioCardGenerator")
+    async def create_note(self, data: CardRequest, media_store: Optional[MediaStore] = None) -> Dict[str, Any]:
+        if not media_store:
+            raise ValueError("A media store is required for BasicAudioCardGenerator")
 
         original_filename = data.audio_url.split('/')[-1]
         _, extension = os.path.splitext(original_filename)
-        filename = f"{uuid.uuid4()}{extension}"
-        stored_filename = anki_service.store_media_file_from_url(filename, data.audio_url)
+        stored_filename = await media_store.store_media_from_url(data.audio_url, extension)
         return {
             "deckName": data.deck_name,
             "modelName": "Basic",
@@ -72,7 +81,7 @@ class BasicAudioCardGeneratorAnki(CardGenerator):
         return STORAGE_MODE == STORAGE_MODE_ANKI
 
 class BasicAudioCardGeneratorUrl(CardGenerator):
-    def create_note(self, data: CardRequest, anki_service: Optional[AnkiConnectService] = None) -> Dict[str, Any]:
+    async def create_note(self, data: CardRequest, media_store: Optional[MediaStore] = None) -> Dict[str, Any]:
         return {
             "deckName": data.deck_name,
             "modelName": "Basic",
@@ -86,7 +95,7 @@ class BasicAudioCardGeneratorUrl(CardGenerator):
         return STORAGE_MODE == STORAGE_MODE_URL
 
 class BasicReversedCardGeneratorUrl(CardGenerator):
-    def create_note(self, data: CardRequest, anki_service: Optional[AnkiConnectService] = None) -> Dict[str, Any]:
+    async def create_note(self, data: CardRequest, media_store: Optional[MediaStore] = None) -> Dict[str, Any]:
         return {
             "deckName": data.deck_name,
             "modelName": "Basic (and reversed card)",
@@ -100,14 +109,13 @@ class BasicReversedCardGeneratorUrl(CardGenerator):
         return STORAGE_MODE == STORAGE_MODE_URL
 
 class BasicReversedCardGeneratorAnki(CardGenerator):
-    def create_note(self, data: CardRequest, anki_service: Optional[AnkiConnectService] = None) -> Dict[str, Any]:
-        if not anki_service:
-            raise ValueError("AnkiConnectService is required for BasicReversedCardGenerator")
+    async def create_note(self, data: CardRequest, media_store: Optional[MediaStore] = None) -> Dict[str, Any]:
+        if not media_store:
+            raise ValueError("A media store is required for BasicReversedCardGenerator")
 
         original_filename = data.image_url.split('/')[-1]
         _, extension = os.path.splitext(original_filename)
-        filename = f"{uuid.uuid4()}{extension}"
-        stored_filename = anki_service.store_media_file_from_url(filename, data.image_url)
+        stored_filename = await media_store.store_media_from_url(data.image_url, extension)
         return {
             "deckName": data.deck_name,
             "modelName": "Basic (and reversed card)",
@@ -132,9 +140,11 @@ class CardFactory:
             "basic_reversed_url": BasicReversedCardGeneratorUrl(),
         }
 
-    def create_all_notes(self, data: CardRequest, anki_service: AnkiConnectService) -> List[Dict[str, Any]]:
+    async def create_all_notes(self, data: CardRequest, media_store: MediaStore) -> List[Dict[str, Any]]:
         available_generators = [gen for gen in self._generators.values() if gen.available()]
-        return [gen.create_note(data, anki_service=anki_service) for gen in available_generators]
+        return list(await asyncio.gather(
+            *[gen.create_note(data, media_store=media_store) for gen in available_generators]
+        ))
 
 
 card_factory = CardFactory()
@@ -0,0 +1,203 @@
+import asyncio
+import codecs
+import csv
+import json
+import logging
+from typing import AsyncIterator, Dict, Any, List, Tuple
+
+from fastapi import UploadFile
+from pydantic import ValidationError
+
+from .anki_connect_service import AnkiConnectService, AnkiConnectError
+from .card_generator_service import CardFactory, card_factory
+from ..config import IMPORT_CHUNK_SIZE, IMPORT_MAX_RECORD_CHARS
+from ..schemas import CardRequest
+
+IMPORT_FORMAT_CSV = "csv"
+IMPORT_FORMAT_JSONL = "jsonl"
+
+# CSV cells holding several generated options separate them with this character
+CSV_LIST_SEPARATOR = "|"
+
+UPLOAD_READ_SIZE = 64 * 1024
+
+
+async def iter_upload(file: UploadFile) -> AsyncIterator[bytes]:
+    while chunk := await file.read(UPLOAD_READ_SIZE):
+        yield chunk
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Splits a stream of UTF-8 encoded bytes into lines, without the line endings."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    async for chunk in chunks:
+        tail += decoder.decode(chunk)
+        *lines, tail = tail.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail.rstrip("\r")
+
+
+async def iter_csv_records(lines: AsyncIterator[str],
+                           max_record_chars: int = IMPORT_MAX_RECORD_CHARS) -> AsyncIterator[Tuple[int, Any]]:
+    """
+    Yields numbered rows as dicts keyed by the header.
+
+    A record longer than `max_record_chars` is reported as an error in its
+    place and parsing resumes on the next line.
+    """
+    header = None
+    record: List[str] = []
+    record_chars = 0
+    quotes = 0
+    row_number = 0
+    async for line in lines:
+        record.append(line)
+        record_chars += len(line) + 1
+        quotes += line.count('"')
+        # An odd number of quotes means a quoted cell continues on the next line
+        if quotes % 2:
+            if record_chars > max_record_chars:
+                row_number += 1
+                record, record_chars, quotes = [], 0, 0
+                yield row_number, ValueError(
+                    f"CSV record longer than {max_record_chars} characters, is a quote not closed?"
+                )
+            continue
+        if record == [""]:
+            record, record_chars, quotes = [], 0, 0
+            continue
+        values = next(csv.reader(["\n".join(record)]))
+        record, record_chars, quotes = [], 0, 0
+        if header is None:
+            header = values
+            continue
+        row_number += 1
+        row = dict(zip(header, values))
+        if "generatedOptions" in row:
+            row["generatedOptions"] = [
+                option.strip() for option in row["generatedOptions"].split(CSV_LIST_SEPARATOR) if option.strip()
+            ]
+        yield row_number, row
+
+
+async def iter_jsonl_records(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    row_number = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            yield row_number, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, e
+
+
+def iter_records(chunks: AsyncIterator[bytes], import_format: str) -> AsyncIterator[Tuple[int, Any]]:
+    if import_format == IMPORT_FORMAT_CSV:
+        return iter_csv_records(iter_lines(chunks))
+    if import_format == IMPORT_FORMAT_JSONL:
+        return iter_jsonl_records(iter_lines(chunks))
+    raise ValueError(f"Unsupported import format: {import_format}")
+
+
+class CardImportService:
+    """
+    Turns a stream of card rows into Anki notes, one chunk at a time.
+
+    Every chunk shares one AnkiConnectBatch: its media files are checked in one
+    request, the missing ones stored in another and all notes added with a
+    single addNotes call. A chunk costs at most three round trips however many
+    media files it has, and memory use depends on the chunk size only.
+    """
+
+    def __init__(self, anki_service: AnkiConnectService, factory: CardFactory = card_factory,
+                 chunk_size: int = IMPORT_CHUNK_SIZE):
+        self.anki_service = anki_service
+        self.factory = factory
+        self.chunk_size = chunk_size
+        self.logger = logging.getLogger(__name__)
+
+    async def import_cards(self, records: AsyncIterator[Tuple[int, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """Yields a progress item per row."""
+        chunk: List[Tuple[int, CardRequest]] = []
+        async for row_number, record in records:
+            try:
+                if isinstance(record, Exception):
+                    raise record
+                chunk.append((row_number, CardRequest(**record)))
+            except (ValidationError, ValueError, TypeError) as e:
+                yield _row_error(row_number, e)
+                continue
+            if len(chunk) >= self.chunk_size:
+                async for progress in self._import_chunk(chunk):
+                    yield progress
+                chunk = []
+        if chunk:
+            async for progress in self._import_chunk(chunk):
+                yield progress
+
+    async def _import_chunk(self, chunk: List[Tuple[int, CardRequest]]) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            deck_names = await self.anki_service.get_deck_names()
+            for deck_name in {request.deck_name for _, request in chunk} - set(deck_names):
+                await self.anki_service.create_deck(deck_name)
+
+            rows = []
+            batch = self.anki_service.batch()
+            chunk_notes = await asyncio.gather(
+                *[self.factory.create_all_notes(request, batch) for _, request in chunk],
+                return_exceptions=True
+            )
+            for (row_number, _), notes in zip(chunk, chunk_notes):
+                if isinstance(notes, Exception):
+                    yield _row_error(row_number, notes)
+                else:
+                    rows.append((row_number, notes))
+        except Exception as e:
+            for row_number, _ in chunk:
+                yield _row_error(row_number, e)
+            return
+
+        if not rows:
+            return
+        try:
+            notes_index = batch.add("addNotes", notes=[note for _, notes in rows for note in notes])
+            note_ids = (await batch.execute())[notes_index]
+        except AnkiConnectError as e:
+            if e.action != "addNotes":
+                for row_number, _ in rows:
+                    yield _row_error(row_number, e)
+                return
+            # Media files are stored by now, find out which rows were rejected one by one
+            self.logger.warning(f"Chunk import failed, retrying rows one by one: {str(e)}")
+            async for progress in self._import_rows(rows):
+                yield progress
+            return
+        except Exception as e:
+            for row_number, _ in rows:
+                yield _row_error(row_number, e)
+            return
+
+        offset = 0
+        for row_number, notes in rows:
+            yield _row_added(row_number, note_ids[offset:offset + len(notes)])
+            offset += len(notes)
+
+    async def _import_rows(self, rows: List[Tuple[int, List[Dict[str, Any]]]]) -> AsyncIterator[Dict[str, Any]]:
+        for row_number, notes in rows:
+            try:
+                yield _row_added(row_number, await self.anki_service.add_notes(notes))
+            except Exception as e:
+                yield _row_error(row_number, e)
+
+
+def _row_added(row_number: int, note_ids: List[int]) -> Dict[str, Any]:
+    return {"row": row_number, "status": "added", "added_notes_ids": note_ids}
+
+
+def _row_error(row_number: int, error: Exception) -> Dict[str, Any]:
+    return {"row": row_number, "status": "error", "error": str(error)}
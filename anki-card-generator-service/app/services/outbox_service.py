@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from ..config import (
+    OUTBOX_DB_PATH,
+    OUTBOX_WORKERS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_BACKOFF_SECONDS,
+    OUTBOX_MAX_BACKOFF_SECONDS,
+    OUTBOX_POLL_SECONDS,
+    OUTBOX_RETENTION_SECONDS,
+)
+
+JOB_STATUS_QUEUED = "queued"
+JOB_STATUS_RUNNING = "running"
+JOB_STATUS_DONE = "done"
+JOB_STATUS_FAILED = "failed"
+
+
+class PermanentJobError(Exception):
+    """Raised by a job handler when retrying the job cannot help."""
+
+
+class OutboxQueue:
+    """
+    SQLite-backed queue of jobs, which survives restarts of the service.
+
+    All methods block on the database, use the async wrappers of OutboxWorker
+    from the event loop.
+    """
+
+    def __init__(self, db_path: str = OUTBOX_DB_PATH):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                last_error TEXT,
+                result TEXT,
+                progress TEXT
+            )
+            """
+        )
+        columns = {row["name"] for row in self._connection.execute("PRAGMA table_info(jobs)")}
+        if "progress" not in columns:
+            # Outboxes created before job progress was kept
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status_next_attempt ON jobs (status, next_attempt_at)")
+
+    def enqueue(self, payload: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO jobs (job_id, status, payload, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, JOB_STATUS_QUEUED, json.dumps(payload), now, now, now)
+            )
+        return job_id
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """Marks the oldest due job as running and returns it."""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM jobs WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT 1",
+                (JOB_STATUS_QUEUED, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+                (JOB_STATUS_RUNNING, now, row["job_id"])
+            )
+        job = _job(row)
+        job["attempts"] += 1
+        return job
+
+    def seconds_until_next_attempt(self) -> Optional[float]:
+        with self._lock:
+            next_attempt_at = self._connection.execute(
+                "SELECT MIN(next_attempt_at) FROM jobs WHERE status = ?", (JOB_STATUS_QUEUED,)
+            ).fetchone()[0]
+        return max(next_attempt_at - time.time(), 0) if next_attempt_at is not None else None
+
+    def complete(self, job_id: str, result: Any) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, last_error = NULL, updated_at = ? WHERE job_id = ?",
+                (JOB_STATUS_DONE, json.dumps(result), time.time(), job_id)
+            )
+
+    def save_progress(self, job_id: str, progress: Dict[str, Any]) -> None:
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET progress = ?, updated_at = ? WHERE job_id = ?",
+                (json.dumps(progress), time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str, retry_at: Optional[float]) -> None:
+        """Puts the job back in the queue until retry_at, or fails it for good when retry_at is None."""
+        status = JOB_STATUS_FAILED if retry_at is None else JOB_STATUS_QUEUED
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, last_error = ?, next_attempt_at = ?, updated_at = ? WHERE job_id = ?",
+                (status, error, retry_at or now, now, job_id)
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return _job(row) if row is not None else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            oldest = self._connection.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status IN (?, ?)", (JOB_STATUS_QUEUED, JOB_STATUS_RUNNING)
+            ).fetchone()[0]
+        return {
+            "depth": counts.get(JOB_STATUS_QUEUED, 0) + counts.get(JOB_STATUS_RUNNING, 0),
+            "oldest_pending_age_seconds": round(time.time() - oldest, 3) if oldest else None,
+            "by_status": {status: counts.get(status, 0) for status in
+                          [JOB_STATUS_QUEUED, JOB_STATUS_RUNNING, JOB_STATUS_DONE, JOB_STATUS_FAILED]},
+        }
+
+    def recover(self, retention_seconds: float = OUTBOX_RETENTION_SECONDS) -> None:
+        """Requeues jobs interrupted by a shutdown and drops old finished ones."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?",
+                (JOB_STATUS_QUEUED, now, JOB_STATUS_RUNNING)
+            )
+            self._connection.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (JOB_STATUS_DONE, JOB_STATUS_FAILED, now - retention_seconds)
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+def _job(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+    job["progress"] = json.loads(job["progress"]) if job["progress"] is not None else {}
+    return job
+
+
+class JobContext:
+    """
+    Progress a job handler saves along the way.
+
+    Saved progress is handed to the retries of the job, so steps that already
+    succeeded, such as adding the notes, are not repeated.
+    """
+
+    def __init__(self, queue: OutboxQueue, job: Dict[str, Any]):
+        self.queue = queue
+        self.job_id = job["job_id"]
+        self.attempts = job["attempts"]
+        self.progress: Dict[str, Any] = job["progress"]
+
+    async def save(self, **values) -> None:
+        self.progress.update(values)
+        await run_in_threadpool(self.queue.save_progress, self.job_id, self.progress)
+
+
+class OutboxWorker:
+    """
+    Drains the outbox with a bounded number of concurrent workers.
+
+    Failed jobs are retried with exponential backoff until OUTBOX_MAX_ATTEMPTS
+    is reached, a PermanentJobError fails a job right away.
+    """
+
+    def __init__(self, queue: OutboxQueue, handler: Callable[[Dict[str, Any], JobContext], Awaitable[Any]],
+                 workers: int = OUTBOX_WORKERS, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 backoff_seconds: float = OUTBOX_BACKOFF_SECONDS,
+                 max_backoff_seconds: float = OUTBOX_MAX_BACKOFF_SECONDS,
+                 poll_seconds: float = OUTBOX_POLL_SECONDS):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.poll_seconds = poll_seconds
+        self.logger = logging.getLogger(__name__)
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        await run_in_threadpool(self.queue.recover)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, payload: Dict[str, Any]) -> str:
+        job_id = await run_in_threadpool(self.queue.enqueue, payload)
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await run_in_threadpool(self.queue.get, job_id)
+
+    async def stats(self) -> Dict[str, Any]:
+        stats = await run_in_threadpool(self.queue.stats)
+        stats["workers"] = self.workers
+        return stats
+
+    async def _work(self) -> None:
+        while True:
+            # Cleared before claiming, so a job enqueued while the claim runs still wakes this worker up
+            self._wakeup.clear()
+            job = await run_in_threadpool(self.queue.claim)
+            if job is None:
+                timeout = await run_in_threadpool(self.queue.seconds_until_next_attempt)
+                timeout = self.poll_seconds if timeout is None else min(timeout, self.poll_seconds)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(job)
+
+    async def _process(self, job: Dict[str, Any]) -> None:
+        try:
+            result = await self.handler(job["payload"], JobContext(self.queue, job))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            retry_at = None
+            if not isinstance(e, PermanentJobError) and job["attempts"] < self.max_attempts:
+                delay = min(self.backoff_seconds * 2 ** (job["attempts"] - 1), self.max_backoff_seconds)
+                retry_at = time.time() + delay
+            self.logger.warning(
+                f"Job {job['job_id']} failed on attempt {job['attempts']}"
+                f"{', retrying' if retry_at else ''}: {str(e)}"
+            )
+            await run_in_threadpool(self.queue.fail, job["job_id"], str(e), retry_at)
+            return
+        await run_in_threadpool(self.queue.complete, job["job_id"], result)
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+import httpx
+
+from .anki_connect_service import AnkiConnectService
+from ..config import STORAGE_SERVICE_URL, DEDUPE_TIMEOUT
+from ..schemas import PhraseLookup
+
+# Field of the AllInOne note holding the phrase in the source language
+ANKI_PHRASE_FIELD = "Q_1"
+
+
+def normalize_phrase(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+
+def _anki_search_term(key: str, value: str) -> str:
+    # Anki treats '*' and '_' in search values as wildcards
+    for special in ("\\", '"', "*", "_"):
+        value = value.replace(special, f"\\{special}")
+    return f'"{key}:{value}"'
+
+
+def create_storage_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(timeout=DEDUPE_TIMEOUT)
+
+
+class PhraseDedupeService:
+    """
+    Tells whether cards were already made for a phrase.
+
+    Looks the phrase up in the phrases table of storage-service and among the
+    notes in Anki at the same time. Either source may be unavailable, the
+    lookup then relies on the other one. Each source is given `timeout`
+    seconds, so an offline Anki fails open instead of holding the request
+    for the AnkiConnect connect timeout.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, anki_service: AnkiConnectService,
+                 storage_url: str = STORAGE_SERVICE_URL, timeout: float = DEDUPE_TIMEOUT):
+        self.client = client
+        self.anki_service = anki_service
+        self.storage_url = storage_url.rstrip("/")
+        self.timeout = timeout
+        self.logger = logging.getLogger(__name__)
+
+    async def lookup(self, text: str, deck_name: Optional[str] = None) -> PhraseLookup:
+        normalized = normalize_phrase(text)
+        phrase_ids, note_ids = await asyncio.gather(
+            self._find_phrases(normalized),
+            self._find_notes(text, deck_name),
+            return_exceptions=True
+        )
+        errors = {}
+        if isinstance(phrase_ids, Exception):
+            errors["storage"] = str(phrase_ids) or type(phrase_ids).__name__
+            phrase_ids = []
+        if isinstance(note_ids, Exception):
+            errors["anki"] = str(note_ids) or type(note_ids).__name__
+            note_ids = []
+        return PhraseLookup(
+            text=text,
+            normalized=normalized,
+            duplicate=bool(phrase_ids or note_ids),
+            phrase_ids=phrase_ids,
+            anki_note_ids=note_ids,
+            errors=errors,
+        )
+
+    async def remember(self, text: str) -> None:
+        """
+        Records the phrase in storage-service unless it is there already, failures are only logged.
+
+        Phrases are unique in storage-service, so cards added with allowDuplicate
+        must not post their phrase a second time.
+        """
+        if not self.storage_url:
+            return
+        normalized = normalize_phrase(text)
+        try:
+            if await self._find_phrases(normalized):
+                return
+            response = await self.client.post(f"{self.storage_url}/phrases/", json={"text_value": normalized})
+            # Recorded by a concurrent request in the meantime
+            if response.is_error and await self._find_phrases(normalized):
+                return
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            self.logger.warning(f"Failed to record phrase in storage service: {str(e)}")
+
+    async def _find_phrases(self, normalized: str) -> List[int]:
+        if not self.storage_url:
+            return []
+        response = await self.client.get(
+            f"{self.storage_url}/search/phrase/exact_by_text_value",
+            params={"text_value": normalized}
+        )
+        response.raise_for_status()
+        return [phrase["id"] for phrase in response.json()]
+
+    async def _find_notes(self, text: str, deck_name: Optional[str]) -> List[int]:
+        query = _anki_search_term(ANKI_PHRASE_FIELD, text.strip())
+        if deck_name:
+            query += " " + _anki_search_term("deck", deck_name)
+        return await asyncio.wait_for(self.anki_service.find_notes(query), self.timeout)
@@ -0,0 +1,98 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Set
+
+from .anki_connect_service import AnkiConnectService
+from ..config import ANKI_SYNC_DEBOUNCE_SECONDS
+from ..schemas import SyncStatus
+
+SYNC_STATUS_NEVER = "never"
+SYNC_STATUS_RUNNING = "running"
+SYNC_STATUS_OK = "ok"
+SYNC_STATUS_ERROR = "error"
+
+
+class SyncScheduler:
+    """
+    Coalesces AnkiWeb sync requests and runs them in the background.
+
+    The first request starts a debounce window, every request arriving within
+    the window is served by the same sync. At most one sync runs at a time.
+    """
+
+    def __init__(self, anki_service: AnkiConnectService, debounce_seconds: float = ANKI_SYNC_DEBOUNCE_SECONDS):
+        self.anki_service = anki_service
+        self.debounce_seconds = debounce_seconds
+        self.logger = logging.getLogger(__name__)
+        self._lock = asyncio.Lock()
+        self._pending: Optional[asyncio.Task] = None
+        # Scheduled syncs, kept until they finish, also once they no longer count as pending
+        self._tasks: Set[asyncio.Task] = set()
+        self._status = SYNC_STATUS_NEVER
+        self._last_started_at: Optional[datetime] = None
+        self._last_finished_at: Optional[datetime] = None
+        self._last_error: Optional[str] = None
+        self._requested = 0
+        self._completed = 0
+
+    def request_sync(self) -> None:
+        """Schedules a sync unless one is already waiting for its window to close."""
+        self._requested += 1
+        if self._pending is None or self._pending.done():
+            self._pending = asyncio.create_task(self._sync_after_window())
+            # The event loop keeps only weak references to tasks
+            self._tasks.add(self._pending)
+            self._pending.add_done_callback(self._tasks.discard)
+
+    async def sync_now(self) -> SyncStatus:
+        """Runs a sync right away, taking over a scheduled one."""
+        self._requested += 1
+        self._cancel_pending()
+        await self._run()
+        return self.get_status()
+
+    def get_status(self) -> SyncStatus:
+        return SyncStatus(
+            status=self._status,
+            pending=self._pending is not None and not self._pending.done(),
+            last_started_at=self._last_started_at,
+            last_finished_at=self._last_finished_at,
+            last_error=self._last_error,
+            requested=self._requested,
+            completed=self._completed,
+        )
+
+    async def close(self) -> None:
+        self._cancel_pending()
+        for task in self._tasks:
+            task.cancel()
+
+    def _cancel_pending(self) -> None:
+        if self._pending is not None and not self._pending.done():
+            self._pending.cancel()
+        self._pending = None
+
+    async def _sync_after_window(self) -> None:
+        await asyncio.sleep(self.debounce_seconds)
+        # Requests arriving from now on need a sync of their own
+        self._pending = None
+        await self._run()
+
+    async def _run(self) -> None:
+        async with self._lock:
+            self._status = SYNC_STATUS_RUNNING
+            self._last_started_at = datetime.now(timezone.utc)
+            try:
+                await self.anki_service.sync()
+                # Decks and models may have arrived from other devices
+                self.anki_service.invalidate_metadata()
+                self._status = SYNC_STATUS_OK
+                self._last_error = None
+            except Exception as e:
+                self.logger.error(f"Error syncing with AnkiWeb: {str(e)}")
+                self._status = SYNC_STATUS_ERROR
+                self._last_error = str(e)
+            finally:
+                self._last_finished_at = datetime.now(timezone.utc)
+                self._completed += 1
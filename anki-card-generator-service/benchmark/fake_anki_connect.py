@@ -0,0 +1,159 @@
+"""
+A stand-in for Anki with the AnkiConnect add-on, for benchmarks without a desktop Anki.
+
+Keeps decks, notes and media in memory and answers the actions used by the card
+generator service. Every action can be slowed down and made to fail at random:
+
+    python benchmark/fake_anki_connect.py --port 8765 --latency-ms 20 \\
+        --action-latency-ms sync=1500 --action-latency-ms addNotes=50 --failure-rate 0.01
+
+GET /media/{name} serves generated media files, so that card requests can point
+their imageUrl and audioUrl at this server. GET /stats shows action counters.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import random
+from collections import Counter
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+DEFAULT_MODELS = ["AllInOne (kprim, mc, sc)", "Basic", "Basic (and reversed card)", "Cloze"]
+
+
+class FakeAnki:
+    def __init__(self, latency_ms: float = 0, action_latency_ms: Dict[str, float] = None,
+                 failure_rate: float = 0, media_size: int = 32 * 1024):
+        self.latency_ms = latency_ms
+        self.action_latency_ms = action_latency_ms or {}
+        self.failure_rate = failure_rate
+        self.media_size = media_size
+        self.decks: Dict[str, int] = {"Default": 1}
+        self.models = list(DEFAULT_MODELS)
+        self.notes: List[Dict[str, Any]] = []
+        self.media: Dict[str, int] = {}
+        self.calls = Counter()
+        self.failures = Counter()
+        # Anki handles one request at a time
+        self._lock = asyncio.Lock()
+
+    async def invoke(self, action: str, params: Dict[str, Any]) -> Any:
+        self.calls[action] += 1
+        latency_ms = self.action_latency_ms.get(action, self.latency_ms)
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        if action != "multi" and random.random() < self.failure_rate:
+            self.failures[action] += 1
+            raise Exception(f"injected failure in {action}")
+        handler = getattr(self, f"action_{action}", None)
+        if handler is None:
+            raise Exception("unsupported action")
+        return await handler(**params)
+
+    async def action_multi(self, actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        results = []
+        for action in actions:
+            try:
+                results.append({"result": await self.invoke(action["action"], action.get("params", {})), "error": None})
+            except Exception as e:
+                results.append({"result": None, "error": str(e)})
+        return results
+
+    async def action_deckNames(self) -> List[str]:
+        return list(self.decks)
+
+    async def action_modelNames(self) -> List[str]:
+        return self.models
+
+    async def action_createDeck(self, deck: str) -> int:
+        return self.decks.setdefault(deck, len(self.decks) + 1)
+
+    async def action_addNote(self, note: Dict[str, Any]) -> int:
+        if note["deckName"] not in self.decks:
+            raise Exception(f"deck was not found: {note['deckName']}")
+        if note["modelName"] not in self.models:
+            raise Exception(f"model was not found: {note['modelName']}")
+        self.notes.append(note)
+        return len(self.notes)
+
+    async def action_addNotes(self, notes: List[Dict[str, Any]]) -> List[int]:
+        return [await self.action_addNote(note) for note in notes]
+
+    async def action_storeMediaFile(self, filename: str, data: str = None, url: str = None, **_) -> str:
+        self.media[filename] = len(base64.b64decode(data)) if data else self.media_size
+        return filename
+
+    async def action_getMediaFilesNames(self, pattern: str = "*") -> List[str]:
+        if pattern == "*":
+            return list(self.media)
+        return [pattern] if pattern in self.media else []
+
+    async def action_findNotes(self, query: str) -> List[int]:
+        return []
+
+    async def action_sync(self) -> None:
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": dict(self.calls),
+            "failures": dict(self.failures),
+            "decks": len(self.decks),
+            "notes": len(self.notes),
+            "media_files": len(self.media),
+            "media_bytes": sum(self.media.values()),
+        }
+
+
+def create_app(fake_anki: FakeAnki) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/")
+    async def invoke(request: Request):
+        payload = await request.json()
+        async with fake_anki._lock:
+            try:
+                result = await fake_anki.invoke(payload["action"], payload.get("params", {}))
+                return JSONResponse({"result": result, "error": None})
+            except Exception as e:
+                return JSONResponse({"result": None, "error": str(e)})
+
+    @app.get("/media/{name}")
+    async def get_media(name: str):
+        # Content depends on the name only, so equal URLs give equal files
+        seed = hashlib.sha256(name.encode("utf-8")).digest()
+        content = (seed * (fake_anki.media_size // len(seed) + 1))[:fake_anki.media_size]
+        return Response(content, media_type="application/octet-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return fake_anki.stats()
+
+    return app
+
+
+def parse_action_latency(values: List[str]) -> Dict[str, float]:
+    latency = {}
+    for value in values:
+        action, _, milliseconds = value.partition("=")
+        latency[action] = float(milliseconds)
+    return latency
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake AnkiConnect server")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0, help="latency of every action")
+    parser.add_argument("--action-latency-ms", action="append", default=[],
+                        help="latency of a single action, e.g. sync=1500, can be repeated")
+    parser.add_argument("--failure-rate", type=float, default=0, help="share of actions failing, 0..1")
+    parser.add_argument("--media-size", type=int, default=32 * 1024, help="size of served media files in bytes")
+    args = parser.parse_args()
+
+    fake = FakeAnki(args.latency_ms, parse_action_latency(args.action_latency_ms), args.failure_rate, args.media_size)
+    uvicorn.run(create_app(fake), host=args.host, port=args.port)
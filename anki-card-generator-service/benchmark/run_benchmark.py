@@ -0,0 +1,103 @@
+"""
+Load benchmark for the card generator service.
+
+Sends /generate-cards requests at increasing concurrency and waits for every
+queued job to finish, then reports latency percentiles and throughput per level.
+Start the fake Anki and the service pointing at it first:
+
+    python benchmark/fake_anki_connect.py --port 8765 --latency-ms 20
+    ANKI_CONNECT_URL=http://localhost:8765 OUTBOX_DB_PATH=/tmp/bench-outbox.sqlite3 STORAGE_SERVICE_URL= \\
+        uvicorn app.main:app --port 8010
+    python benchmark/run_benchmark.py --service-url http://localhost:8010 \\
+        --media-url http://localhost:8765/media --concurrency 1 4 16 --requests 200
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import Any, Dict, List
+
+import httpx
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(percent / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def card_request(media_url: str, index: int, reuse_media: bool) -> Dict[str, Any]:
+    media_name = "shared" if reuse_media else uuid.uuid4().hex
+    return {
+        "deckName": "Benchmark",
+        "sourceLangSentence": f"frase {index} {uuid.uuid4().hex[:8]}",
+        "targetLangSentence": f"phrase {index}",
+        "imageUrl": f"{media_url}/{media_name}.png",
+        "audioUrl": f"{media_url}/{media_name}.mp3",
+        "generatedOptions": ["uno", "dos", "tres"],
+        "clozeSentence": "{{c1::frase}}",
+    }
+
+
+async def run_request(client: httpx.AsyncClient, payload: Dict[str, Any], poll_interval: float) -> Dict[str, Any]:
+    started = time.perf_counter()
+    response = await client.post("/generate-cards", json=payload)
+    response.raise_for_status()
+    accepted = time.perf_counter() - started
+    job_id = response.json()["job_id"]
+    while True:
+        job = (await client.get(f"/jobs/{job_id}")).json()
+        if job["status"] in ("done", "failed"):
+            return {"accepted": accepted, "completed": time.perf_counter() - started, "status": job["status"]}
+        await asyncio.sleep(poll_interval)
+
+
+async def run_level(client: httpx.AsyncClient, args: argparse.Namespace, concurrency: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(index: int):
+        async with semaphore:
+            try:
+                return await run_request(client, card_request(args.media_url, index, args.reuse_media), args.poll_interval)
+            except httpx.HTTPError as e:
+                return {"status": "error", "error": str(e)}
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[limited(index) for index in range(args.requests)])
+    elapsed = time.perf_counter() - started
+
+    completed = [result for result in results if result["status"] == "done"]
+    report = {
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "done": len(completed),
+        "failed": len(results) - len(completed),
+        "requests_per_second": round(len(completed) / elapsed, 2),
+    }
+    for key in ("accepted", "completed"):
+        latencies = [result[key] * 1000 for result in completed]
+        if latencies:
+            for percent in (50, 95, 99):
+                report[f"{key}_p{percent}_ms"] = round(percentile(latencies, percent), 1)
+    return report
+
+
+async def main(args: argparse.Namespace) -> None:
+    limits = httpx.Limits(max_connections=max(args.concurrency) * 2)
+    async with httpx.AsyncClient(base_url=args.service_url, timeout=args.timeout, limits=limits) as client:
+        for concurrency in args.concurrency:
+            print(json.dumps(await run_level(client, args, concurrency)), flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Card generator load benchmark")
+    parser.add_argument("--service-url", default="http://localhost:8010")
+    parser.add_argument("--media-url", default="http://localhost:8765/media",
+                        help="base URL serving media files, e.g. the fake AnkiConnect server")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    parser.add_argument("--reuse-media", action="store_true", help="point every request at the same media files")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="seconds between job status checks")
+    parser.add_argument("--timeout", type=float, default=120)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,47 @@
+import asyncio
+import sqlite3
+import zipfile
+
+import httpx
+
+from app.services.apkg_builder_service import ApkgPackageBuilder, build_package
+from app.services.card_generator_service import AllInOneCardGenerator
+
+ROW = {
+    "deckName": "Spanish",
+    "sourceLangSentence": "coche",
+    "targetLangSentence": "car",
+    "imageUrl": "",
+    "audioUrl": "",
+    "generatedOptions": ["perro", "casa"],
+    "clozeSentence": "",
+}
+
+
+class AllInOneFactory:
+    async def create_all_notes(self, data, media_store):
+        return [await AllInOneCardGenerator().create_note(data, media_store)]
+
+
+async def iter_rows(rows):
+    for row_number, row in enumerate(rows, start=1):
+        yield row_number, row
+
+
+def test_all_in_one_notes_are_packaged():
+    async def build():
+        async with httpx.AsyncClient() as client:
+            builder = ApkgPackageBuilder(client)
+            try:
+                summary = await build_package(builder, iter_rows([ROW, {"deckName": "Spanish"}]), AllInOneFactory())
+                with zipfile.ZipFile(builder.write()) as package:
+                    collection_path = package.extract("collection.anki2", builder.work_dir)
+                with sqlite3.connect(collection_path) as collection:
+                    fields = [row[0] for row in collection.execute("SELECT flds FROM notes")]
+                return summary, fields
+            finally:
+                builder.cleanup()
+
+    summary, fields = asyncio.run(build())
+    assert summary == {"notes": 1, "skipped_notes": 0, "failed_rows": [2]}
+    assert fields == ["\x1f".join(["car", "", "2", "coche", "perro", "casa", "", "", "1 0 0", "", ""])]
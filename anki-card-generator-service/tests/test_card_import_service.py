@@ -0,0 +1,74 @@
+import asyncio
+import json
+from typing import AsyncIterator, List
+
+from app.services.card_import_service import iter_csv_records, iter_jsonl_records, iter_lines
+
+
+async def iter_chunks(chunks: List[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+def read_records(records: AsyncIterator) -> list:
+    async def collect():
+        return [record async for record in records]
+    return asyncio.run(collect())
+
+
+def parse_csv(*chunks: bytes) -> list:
+    return read_records(iter_csv_records(iter_lines(iter_chunks(list(chunks)))))
+
+
+def parse_jsonl(*chunks: bytes) -> list:
+    return read_records(iter_jsonl_records(iter_lines(iter_chunks(list(chunks)))))
+
+
+def test_lines_split_across_chunks():
+    text = "¿Dónde está?\r\nhola\nadiós".encode()
+    # Cut inside a multi-byte character and between \r and \n
+    chunks = [text[:2], text[2:15], text[15:]]
+    assert read_records(iter_lines(iter_chunks(chunks))) == ["¿Dónde está?", "hola", "adiós"]
+
+
+def test_lines_skip_byte_order_mark():
+    assert read_records(iter_lines(iter_chunks(["﻿phrase\n".encode()]))) == ["phrase"]
+
+
+def test_csv_rows_are_numbered_after_the_header():
+    records = parse_csv(b"phrase,translation\nhola,hello\n\nadios,bye\n")
+    assert records == [
+        (1, {"phrase": "hola", "translation": "hello"}),
+        (2, {"phrase": "adios", "translation": "bye"}),
+    ]
+
+
+def test_csv_quoted_cell_spans_lines():
+    records = parse_csv(b'phrase,translation\n"hola\nque tal","hello, how"\n')
+    assert records == [(1, {"phrase": "hola\nque tal", "translation": "hello, how"})]
+
+
+def test_csv_splits_generated_options():
+    records = parse_csv(b"phrase,generatedOptions\nhola,uno| dos ||tres\n")
+    assert records[0][1]["generatedOptions"] == ["uno", "dos", "tres"]
+
+
+def test_csv_unclosed_quote_is_reported_and_parsing_resumes():
+    lines = ["phrase,translation", 'hola,"hello', "a,b", "c,d", "adios,bye"]
+
+    async def iter_strings():
+        for line in lines:
+            yield line
+
+    records = read_records(iter_csv_records(iter_strings(), max_record_chars=15))
+    assert records[0][0] == 1
+    assert isinstance(records[0][1], ValueError)
+    assert records[1:] == [(2, {"phrase": "c", "translation": "d"}), (3, {"phrase": "adios", "translation": "bye"})]
+
+
+def test_jsonl_reports_invalid_lines_in_place():
+    records = parse_jsonl(b'{"phrase": "hola"}\n\nnot json\n{"phrase": "adios"}')
+    assert records[0] == (1, {"phrase": "hola"})
+    assert records[1][0] == 2
+    assert isinstance(records[1][1], json.JSONDecodeError)
+    assert records[2] == (3, {"phrase": "adios"})
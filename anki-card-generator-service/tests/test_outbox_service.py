@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.outbox_service import (
+    JOB_STATUS_DONE,
+    JOB_STATUS_FAILED,
+    JOB_STATUS_QUEUED,
+    JOB_STATUS_RUNNING,
+    OutboxQueue,
+    OutboxWorker,
+    PermanentJobError,
+)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = OutboxQueue(str(tmp_path / "outbox.sqlite3"))
+    yield queue
+    queue.close()
+
+
+def test_claim_returns_due_jobs_once(queue):
+    job_id = queue.enqueue({"phrase": "hola"})
+
+    job = queue.claim()
+    assert job["job_id"] == job_id
+    assert job["payload"] == {"phrase": "hola"}
+    assert job["attempts"] == 1
+    assert job["progress"] == {}
+    assert queue.get(job_id)["status"] == JOB_STATUS_RUNNING
+    assert queue.claim() is None
+
+
+def test_failed_job_waits_for_its_retry(queue):
+    job_id = queue.enqueue({})
+    queue.claim()
+
+    queue.fail(job_id, "boom", time.time() + 60)
+    job = queue.get(job_id)
+    assert job["status"] == JOB_STATUS_QUEUED
+    assert job["last_error"] == "boom"
+    assert queue.claim() is None
+    assert 0 < queue.seconds_until_next_attempt() <= 60
+
+    queue.fail(job_id, "boom", time.time())
+    assert queue.claim()["attempts"] == 2
+
+
+def test_failing_without_retry_is_final(queue):
+    job_id = queue.enqueue({})
+    queue.claim()
+    queue.fail(job_id, "bad payload", None)
+    assert queue.get(job_id)["status"] == JOB_STATUS_FAILED
+    assert queue.claim() is None
+
+
+def test_recover_requeues_interrupted_jobs(queue):
+    job_id = queue.enqueue({})
+    queue.claim()
+    queue.recover()
+    assert queue.claim()["job_id"] == job_id
+
+
+def run_job(queue: OutboxQueue, handler, **options) -> dict:
+    """Runs one job through a worker until it is done or failed for good, returns the job."""
+    async def run():
+        worker = OutboxWorker(queue, handler, workers=1, backoff_seconds=0, poll_seconds=0.05, **options)
+        await worker.start()
+        job_id = await worker.enqueue({"phrase": "hola"})
+        try:
+            for _ in range(100):
+                job = await worker.get(job_id)
+                if job["status"] in (JOB_STATUS_DONE, JOB_STATUS_FAILED):
+                    return job
+                await asyncio.sleep(0.02)
+            raise AssertionError("The job did not finish")
+        finally:
+            await worker.stop()
+    return asyncio.run(run())
+
+
+def test_retry_resumes_from_saved_progress(queue):
+    calls = []
+
+    async def handler(payload, context):
+        calls.append(dict(context.progress))
+        if "added_notes_ids" not in context.progress:
+            await context.save(added_notes_ids=[1, 2])
+        if context.attempts < 2:
+            raise RuntimeError("media upload failed")
+        return context.progress["added_notes_ids"]
+
+    job = run_job(queue, handler)
+
+    assert calls == [{}, {"added_notes_ids": [1, 2]}]
+    assert job["status"] == JOB_STATUS_DONE
+    assert job["result"] == [1, 2]
+
+
+def test_permanent_error_is_not_retried(queue):
+    calls = []
+
+    async def handler(payload, context):
+        calls.append(context.attempts)
+        raise PermanentJobError("unknown deck")
+
+    job = run_job(queue, handler)
+    assert job["status"] == JOB_STATUS_FAILED
+    assert calls == [1]
+
+
+def test_attempts_are_capped(queue):
+    async def handler(payload, context):
+        raise RuntimeError("Anki is offline")
+
+    job = run_job(queue, handler, max_attempts=3)
+    assert job["status"] == JOB_STATUS_FAILED
+    assert job["attempts"] == 3
+    assert job["last_error"] == "Anki is offline"
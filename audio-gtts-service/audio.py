@@ -1,33 +1,177 @@
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import Response
 from pydantic import BaseModel
 import uvicorn
+import asyncio
+import base64
 import os
-import io
+import re
+from typing import Dict, List, Optional
+import httpx
 from gtts import gTTS
+from gtts.tts import gTTSError
+
+try:
+    # gTTS internals, checked against the version pinned in requirements.txt
+    from gtts.utils import _translate_url
+except ImportError:
+    _translate_url = None
+
+from audio_cache import AudioFileCache
 
 APP_PORT = int(os.getenv("APP_PORT", default="8000"))
+# Segments of one text fetched at the same time, and pooled connections to Google
+GTTS_SEGMENT_CONCURRENCY = int(os.getenv("GTTS_SEGMENT_CONCURRENCY", default="8"))
+GTTS_MAX_CONNECTIONS = int(os.getenv("GTTS_MAX_CONNECTIONS", default="32"))
+# Segments fetched at the same time across all texts, the rest wait instead of timing out in the pool
+GTTS_MAX_PARALLEL_SEGMENTS = int(os.getenv("GTTS_MAX_PARALLEL_SEGMENTS", default=str(GTTS_MAX_CONNECTIONS)))
+GTTS_TIMEOUT_SECONDS = float(os.getenv("GTTS_TIMEOUT_SECONDS", default="10"))
+GTTS_PATH = "_/TranslateWebserverUi/data/batchexecute"
+GTTS_AUDIO_PATTERN = re.compile(r'jQ1olc","\[\\"(.*)\\"]')
 app = FastAPI()
 
 
+class SegmentFetcher:
+    """
+    Fetches the segments of a gTTS text concurrently over a pooled client.
+
+    gTTS splits long text into segments of about 100 characters and fetches
+    them one by one, here they are fetched at the same time, at most
+    `concurrency` per text and `max_parallel` overall, and their MP3 frames
+    are joined in order.
+    """
+
+    def __init__(self, concurrency: int = GTTS_SEGMENT_CONCURRENCY, max_connections: int = GTTS_MAX_CONNECTIONS,
+                 timeout: float = GTTS_TIMEOUT_SECONDS, max_parallel: int = GTTS_MAX_PARALLEL_SEGMENTS):
+        self.concurrency = concurrency
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_parallel = max_parallel
+        self.parallel = asyncio.Semaphore(max_parallel)
+        self.client: Optional[httpx.AsyncClient] = None
+        self.texts = 0
+        self.segments = 0
+
+    async def start(self) -> None:
+        self.client = httpx.AsyncClient(
+            headers=getattr(gTTS, "GOOGLE_TTS_HEADERS", None),
+            limits=httpx.Limits(max_connections=self.max_connections,
+                                max_keepalive_connections=self.max_connections),
+            timeout=self.timeout,
+        )
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+
+    async def fetch(self, tts: gTTS) -> bytes:
+        """Returns the MP3 audio of the text, raises gTTSError if Google refuses a segment."""
+        if _translate_url is None or not hasattr(tts, "get_bodies"):
+            # Another gTTS version, let it fetch the segments one by one
+            self.texts += 1
+            return await run_in_threadpool(lambda: b"".join(tts.stream()))
+        url = _translate_url(tld=tts.tld, path=GTTS_PATH)
+        # Same tokenization and request bodies gTTS would send, one per segment
+        bodies = tts.get_bodies()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def fetch_segment(body: str) -> bytes:
+            async with semaphore, self.parallel:
+                return await self._fetch_segment(url, body)
+
+        segments: List[bytes] = await asyncio.gather(*(fetch_segment(body) for body in bodies))
+        self.texts += 1
+        self.segments += len(bodies)
+        return b"".join(segments)
+
+    async def _fetch_segment(self, url: str, body: str) -> bytes:
+        try:
+            response = await self.client.post(url, content=body)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise gTTSError(f"Failed to fetch a gTTS segment: {e}") from e
+        audio = b""
+        for line in response.text.splitlines():
+            if "jQ1olc" in line:
+                match = GTTS_AUDIO_PATTERN.search(line)
+                if match is None:
+                    raise gTTSError(f"Unexpected gTTS response: {line[:200]}")
+                audio += base64.b64decode(match.group(1).encode("ascii"))
+        return audio
+
+    def stats(self) -> Dict:
+        return {
+            "concurrency": self.concurrency,
+            "max_connections": self.max_connections,
+            "max_parallel": self.max_parallel,
+            "texts": self.texts,
+            "segments": self.segments,
+        }
+
+
+audio_cache = AudioFileCache()
+segment_fetcher = SegmentFetcher()
+# Fetches in progress by cache key, shared by concurrent requests for the same text
+generating: Dict[str, asyncio.Task] = {}
+
+
+@app.on_event("startup")
+async def startup():
+    await segment_fetcher.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await segment_fetcher.close()
+
+
 @app.get("/health")
 def get_health():
     return "OK"
 
 
+@app.get("/metrics")
+def get_metrics():
+    return {"cache": audio_cache.stats(), "segments": segment_fetcher.stats()}
+
+
 class GenerateAudioRequest(BaseModel):
     query: str
     lang: str = "es"
+    tld: str = "com"
+    slow: bool = False
+
+
+async def generate_cached(request: GenerateAudioRequest) -> bytes:
+    key = AudioFileCache.key(request.query, request.lang, request.tld, request.slow)
+    # The file system blocks, and the cache lock is held while evicted files are removed,
+    # keep both off the event loop
+    audio = await run_in_threadpool(audio_cache.get, key)
+    if audio is not None:
+        return audio
+    task = generating.get(key)
+    if task is None:
+        task = asyncio.create_task(generate_uncached(request, key))
+        generating[key] = task
+        task.add_done_callback(lambda _: generating.pop(key, None))
+    # A client that disconnects must not cancel the fetch for the others
+    return await asyncio.shield(task)
+
+
+async def generate_uncached(request: GenerateAudioRequest, key: str) -> bytes:
+    tts = gTTS(text=request.query, lang=request.lang, tld=request.tld, slow=request.slow)
+    audio = await segment_fetcher.fetch(tts)
+    await run_in_threadpool(audio_cache.put, key, lambda file: file.write(audio))
+    return audio
 
 
 @app.post("/generate")
 async def generate(request: GenerateAudioRequest):
     try:
-        audio_data = io.BytesIO()
-        tts = gTTS(text=request.query, lang=request.lang)
-        tts.write_to_fp(audio_data)
-        audio_data.seek(0)
-        return StreamingResponse(audio_data, media_type="audio/mpeg")
+        # Served from memory, a file evicted by a concurrent request cannot fail the response
+        audio = await generate_cached(request)
+        return Response(content=audio, media_type="audio/mpeg")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
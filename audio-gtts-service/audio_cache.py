@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# Generated audio is kept here, oldest used files are removed once the size limit is reached
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", default="cache")
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", default=str(256 * 1024 * 1024)))
+CACHE_FILE_SUFFIX = ".mp3"
+CACHE_TEMP_SUFFIX = ".tmp"
+
+
+class AudioFileCache:
+    """
+    Size-bounded LRU cache of audio files on disk.
+
+    Files are written to a temporary file and renamed into place, so a
+    reader never sees a partial file. Recency is kept in the file
+    modification time, the order survives restarts.
+    """
+
+    def __init__(self, directory: str = AUDIO_CACHE_DIR, max_bytes: int = AUDIO_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            # Anything else in the directory is not ours to touch
+            if not os.path.isfile(path):
+                continue
+            if name.endswith(CACHE_TEMP_SUFFIX):
+                # Leftovers of writes interrupted by a restart
+                os.remove(path)
+                continue
+            if not name.endswith(CACHE_FILE_SUFFIX):
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name[:-len(CACHE_FILE_SUFFIX)], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._sizes[key] = size
+        self._evict()
+        print(f"Loaded {len(self._sizes)} cached audio files ({self.size_bytes} bytes) from {self.directory}")
+
+    @staticmethod
+    def key(text: str, lang: str, tld: str, slow: bool) -> str:
+        return hashlib.sha256(json.dumps([text, lang, tld, slow], ensure_ascii=False).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_FILE_SUFFIX)
+
+    @property
+    def size_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the content of a cached file and marks it as recently used, None on a miss."""
+        with self._lock:
+            if key not in self._sizes:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._sizes.move_to_end(key)
+            path = self.path(key)
+            os.utime(path)
+            # Opened before the lock is released, a concurrent eviction then only unlinks the name
+            file = open(path, "rb")
+        with file:
+            return file.read()
+
+    def put(self, key: str, write) -> str:
+        """Writes a file with `write(file)` and stores it atomically, returns its path."""
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=CACHE_TEMP_SUFFIX, delete=False) as temp_file:
+            try:
+                write(temp_file)
+            except BaseException:
+                temp_file.close()
+                os.remove(temp_file.name)
+                raise
+        path = self.path(key)
+        with self._lock:
+            os.replace(temp_file.name, path)
+            self._sizes[key] = os.path.getsize(path)
+            self._sizes.move_to_end(key)
+            self._evict()
+        return path
+
+    def _evict(self) -> None:
+        total = self.size_bytes
+        # The newest file stays even if it alone exceeds the limit, it is about to be served
+        while total > self.max_bytes and len(self._sizes) > 1:
+            key, size = self._sizes.popitem(last=False)
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "files": len(self._sizes),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / requests, 3) if requests else None,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from audio_cache import AudioFileCache
+
+
+def write(content: bytes):
+    return lambda file: file.write(content)
+
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / "cache")
+
+
+def test_put_then_get(directory):
+    cache = AudioFileCache(directory, max_bytes=100)
+    path = cache.put("a", write(b"audio"))
+
+    assert cache.get("a") == b"audio"
+    with open(path, "rb") as file:
+        assert file.read() == b"audio"
+    assert cache.get("b") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_least_recently_used_file_is_evicted(directory):
+    cache = AudioFileCache(directory, max_bytes=10)
+    cache.put("a", write(b"1234"))
+    cache.put("b", write(b"1234"))
+    cache.get("a")
+    cache.put("c", write(b"1234"))
+
+    assert cache.get("b") is None
+    assert not os.path.exists(cache.path("b"))
+    assert cache.get("a") and cache.get("c")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_newest_file_stays_even_if_too_large(directory):
+    cache = AudioFileCache(directory, max_bytes=2)
+    cache.put("a", write(b"1"))
+    cache.put("b", write(b"12345"))
+    assert cache.get("a") is None
+    assert cache.get("b")
+
+
+def test_failed_write_leaves_nothing_behind(directory):
+    cache = AudioFileCache(directory, max_bytes=100)
+
+    def fail(file):
+        file.write(b"partial")
+        raise IOError("Google refused")
+
+    with pytest.raises(IOError):
+        cache.put("a", fail)
+    assert os.listdir(directory) == []
+    assert cache.get("a") is None
+
+
+def test_startup_restores_files_by_recency(directory):
+    cache = AudioFileCache(directory, max_bytes=100)
+    cache.put("old", write(b"1234"))
+    cache.put("new", write(b"1234"))
+    os.utime(cache.path("old"), (1, 1))
+
+    restarted = AudioFileCache(directory, max_bytes=6)
+    assert restarted.stats()["files"] == 1
+    assert restarted.get("old") is None
+    assert restarted.get("new")
+
+
+def test_startup_removes_only_interrupted_writes(directory):
+    os.makedirs(os.path.join(directory, "nested"))
+    for name in ["leftover.tmp", "notes.txt"]:
+        with open(os.path.join(directory, name), "w") as file:
+            file.write("x")
+
+    cache = AudioFileCache(directory, max_bytes=100)
+
+    assert sorted(os.listdir(directory)) == ["nested", "notes.txt"]
+    assert cache.stats()["files"] == 0
+
+
+def test_hit_survives_eviction_by_concurrent_put(directory, monkeypatch):
+    cache = AudioFileCache(directory, max_bytes=6)
+    cache.put("a", write(b"1234"))
+
+    def open_then_evict(path, mode="r"):
+        file = open(path, mode)
+        # A put evicting "a" between the lookup and the read
+        cache._sizes["b"] = 4
+        cache._evict()
+        return file
+
+    monkeypatch.setattr("audio_cache.open", open_then_evict, raising=False)
+    assert cache.get("a") == b"1234"
+    assert not os.path.exists(cache.path("a"))
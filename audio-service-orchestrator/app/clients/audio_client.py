@@ -1,27 +1,80 @@
-from aiohttp import ClientSession
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Tuple
+import asyncio
 import logging
+import os
+
+from .http_session import HttpSession
+from .resilience import CircuitBreaker
+
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", str(64 * 1024)))
+
+AUDIO_CONTENT_TYPES = ('audio/wav', 'audio/mpeg')
 
 class AudioClient:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, http_session: HttpSession, circuit_breaker: Optional[CircuitBreaker] = None):
         if not base_url.endswith('/'):
             base_url += '/'
         self.base_url = base_url
+        self.http_session = http_session
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(base_url)
         self.logger = logging.getLogger(__name__)
 
-    async def generate_audio(self, session: ClientSession, query: str, speaker: str):
+    async def generate_audio(self, query: str, speaker: str, lang: str = "es"):
         url = f"{self.base_url}generate"
+        if not self.circuit_breaker.allow():
+            self.logger.warning(f"Skipping audio generation, circuit '{self.circuit_breaker.name}' is open")
+            return None
         try:
-            async with session.post(
+            async with self.http_session.session.post(
                 url,
-                json={"query": query, "speaker": speaker},
+                json={"query": query, "speaker": speaker, "lang": lang},
                 timeout=60
             ) as response:
                 response.raise_for_status()
-                if response.content_type == 'audio/wav' or response.content_type == 'audio/mpeg':
-                    return response.content_type, await response.read()
+                if response.content_type in AUDIO_CONTENT_TYPES:
+                    audio_content = await response.read()
+                    self.circuit_breaker.record_success()
+                    return response.content_type, audio_content
+                self.circuit_breaker.record_cancel()
                 self.logger.error(f"Unexpected content type: {response.content_type}")
                 return None
+        except asyncio.CancelledError:
+            self.circuit_breaker.record_cancel()
+            raise
         except Exception as e:
+            self.circuit_breaker.record_error(e)
             self.logger.error(f"Error generating audio: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+    @asynccontextmanager
+    async def stream_audio(self, query: str, speaker: str,
+                           lang: str = "es") -> AsyncIterator[Tuple[str, AsyncIterator[bytes]]]:
+        """
+        Opens a synthesis request without reading its body.
+
+        Yields the content type and an iterator over the body chunks, the
+        response stays open until the context exits. Raises CircuitOpenError
+        while the backend is considered unhealthy.
+        """
+        url = f"{self.base_url}generate"
+        self.circuit_breaker.check()
+        response = None
+        try:
+            response = await self.http_session.session.post(
+                url,
+                json={"query": query, "speaker": speaker, "lang": lang},
+                timeout=60
+            )
+            response.raise_for_status()
+        except BaseException as e:
+            self.circuit_breaker.record_error(e)
+            if response is not None:
+                response.release()
+            raise
+        async with response:
+            if response.content_type not in AUDIO_CONTENT_TYPES:
+                self.circuit_breaker.record_cancel()
+                raise ValueError(f"Unexpected content type: {response.content_type}")
+            self.circuit_breaker.record_success()
+            yield response.content_type, response.content.iter_chunked(STREAM_CHUNK_SIZE)
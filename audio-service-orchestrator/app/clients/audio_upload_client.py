@@ -1,22 +1,31 @@
-from aiohttp import ClientSession, FormData
-from typing import Optional, Dict
+from aiohttp import FormData
+from typing import AsyncIterator, Optional, Dict
+import asyncio
 import logging
 import traceback
 
+from .http_session import HttpSession
+from .resilience import CircuitBreaker
+
 class AudioUploadClient:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, http_session: HttpSession, circuit_breaker: Optional[CircuitBreaker] = None):
         if not base_url.endswith('/'):
             base_url += '/'
         self.base_url = base_url
+        self.http_session = http_session
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(base_url)
         self.logger = logging.getLogger(__name__)
 
     async def upload_file(
-        self, session: ClientSession,
+        self,
         file_name: str,
         file_content: bytes,
         content_type: str = 'audio/wav') -> Optional[Dict]:
 
         url = f"{self.base_url}upload"
+        if not self.circuit_breaker.allow():
+            self.logger.warning(f"Skipping upload, circuit '{self.circuit_breaker.name}' is open")
+            return None
         try:
             data = FormData()
             data.add_field(
@@ -26,7 +35,7 @@ class AudioUploadClient:
                 content_type=content_type
             )
 
-            async with session.post(
+            async with self.http_session.session.post(
                 url,
                 data=data,
                 timeout=60
@@ -34,8 +43,65 @@ class AudioUploadClient:
 
                 response.raise_for_status()
 
-                return await response.json()
+                result = await response.json()
+                self.circuit_breaker.record_success()
+                return result
+        except asyncio.CancelledError:
+            self.circuit_breaker.record_cancel()
+            raise
         except Exception as e:
+            self.circuit_breaker.record_error(e)
             stack_trace_string = traceback.format_exc()
             self.logger.error(f"Error uploading file: {str(e)} {stack_trace_string}")
-            return None
\ No newline at end of file
+            return None
+
+    async def upload_stream(
+        self,
+        file_name: str,
+        chunks: AsyncIterator[bytes],
+        content_type: str = 'audio/wav') -> Optional[Dict]:
+        """
+        Uploads a file from an iterator of chunks, sent as the raw request body.
+        """
+        url = f"{self.base_url}upload-stream"
+        if not self.circuit_breaker.allow():
+            self.logger.warning(f"Skipping upload, circuit '{self.circuit_breaker.name}' is open")
+            return None
+        try:
+            async with self.http_session.session.post(
+                url,
+                params={"filename": file_name},
+                data=chunks,
+                headers={"Content-Type": content_type},
+                timeout=60
+            ) as response:
+
+                response.raise_for_status()
+
+                result = await response.json()
+                self.circuit_breaker.record_success()
+                return result
+        except asyncio.CancelledError:
+            self.circuit_breaker.record_cancel()
+            raise
+        except Exception as e:
+            self.circuit_breaker.record_error(e)
+            stack_trace_string = traceback.format_exc()
+            self.logger.error(f"Error uploading file stream: {str(e)} {stack_trace_string}")
+            return None
+
+    async def delete_file(self, file_name: str) -> bool:
+        """Deletes an uploaded file, returns False if it could not be deleted."""
+        url = f"{self.base_url}delete"
+        try:
+            async with self.http_session.session.delete(
+                url,
+                params={"filename": file_name},
+                timeout=60
+            ) as response:
+
+                response.raise_for_status()
+                return True
+        except Exception as e:
+            self.logger.warning(f"Error deleting file {file_name}: {str(e)}")
+            return False
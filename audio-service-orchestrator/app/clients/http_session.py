@@ -0,0 +1,65 @@
+from aiohttp import ClientSession, TCPConnector
+from typing import Dict, Optional
+import os
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+
+
+class HttpSession:
+    """
+    One aiohttp session for the lifetime of the app, shared by all clients.
+
+    Keeps connections to the backends alive between requests and limits
+    the number of concurrent connections per host.
+    """
+
+    def __init__(self):
+        self._session: Optional[ClientSession] = None
+        self._connector: Optional[TCPConnector] = None
+
+    async def start(self) -> None:
+        self._connector = TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        )
+        self._session = ClientSession(connector=self._connector)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> ClientSession:
+        if self._session is None:
+            raise RuntimeError("HTTP session is not started")
+        return self._session
+
+    def stats(self) -> Dict:
+        connector = self._connector
+        if connector is None or connector.closed:
+            return {"started": False}
+        # aiohttp keeps pool counters private, read them defensively
+        acquired_per_host = getattr(connector, "_acquired_per_host", {})
+        idle_per_host = getattr(connector, "_conns", {})
+        hosts = set(acquired_per_host) | set(idle_per_host)
+        return {
+            "started": True,
+            "limit": connector.limit,
+            "limit_per_host": connector.limit_per_host,
+            "keepalive_timeout": HTTP_KEEPALIVE_TIMEOUT,
+            "dns_cache_ttl": HTTP_DNS_CACHE_TTL,
+            "acquired": len(getattr(connector, "_acquired", ())),
+            "hosts": {
+                f"{key.host}:{key.port}": {
+                    "acquired": len(acquired_per_host.get(key, ())),
+                    "idle": len(idle_per_host.get(key, ())),
+                }
+                for key in hosts
+            },
+        }
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from aiohttp import ClientConnectionError, ClientResponseError
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+
+# A second attempt starts once the first one is slower than this percentile of recent calls
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+LATENCY_WINDOW = int(os.getenv("LATENCY_WINDOW", "200"))
+# Largest fraction of calls that may be hedged, so a slow backend is not sent twice the work
+HEDGE_BUDGET = float(os.getenv("HEDGE_BUDGET", "0.05"))
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half-open"
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str):
+        super().__init__(f"Circuit '{name}' is open, backend is considered unhealthy")
+
+
+def is_backend_failure(error: BaseException) -> bool:
+    """Tells whether an error means the backend is unhealthy, as opposed to a bad request."""
+    if isinstance(error, ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (ClientConnectionError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a backend is unhealthy.
+
+    Opens after `failure_threshold` failures in a row. Once `reset_seconds`
+    have passed a single trial call is let through, its outcome closes
+    the circuit again or keeps it open.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_seconds: float = CIRCUIT_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._trial_running = False
+        self.logger = logging.getLogger(__name__)
+
+    def allow(self) -> bool:
+        if self.state == CIRCUIT_OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self.state = CIRCUIT_HALF_OPEN
+        if self.state == CIRCUIT_CLOSED:
+            return True
+        if self.state == CIRCUIT_HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        self.rejected += 1
+        return False
+
+    def check(self) -> None:
+        """Raises CircuitOpenError if the call is not allowed."""
+        if not self.allow():
+            raise CircuitOpenError(self.name)
+
+    def record_success(self) -> None:
+        if self.state != CIRCUIT_CLOSED:
+            self.logger.info(f"Circuit '{self.name}' closed")
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+        if self.state == CIRCUIT_HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != CIRCUIT_OPEN:
+                self.logger.warning(f"Circuit '{self.name}' opened after {self.failures} failures")
+            self.state = CIRCUIT_OPEN
+            self.opened_at = time.monotonic()
+
+    def record_cancel(self) -> None:
+        # A cancelled call says nothing about the backend, but must not block the next trial
+        self._trial_running = False
+
+    def record_error(self, error: BaseException) -> None:
+        if is_backend_failure(error):
+            self.record_failure()
+        else:
+            self.record_cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyTracker:
+    """
+    Keeps the latencies of the most recent calls to derive a hedging delay.
+
+    Latencies are kept per unit of work, e.g. per character of text, so
+    long inputs get a proportionally longer delay instead of always
+    looking slow.
+    """
+
+    def __init__(self, window: int = LATENCY_WINDOW, percentile: float = HEDGE_PERCENTILE,
+                 min_samples: int = HEDGE_MIN_SAMPLES):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def record(self, seconds: float, size: int = 1) -> None:
+        self._samples.append(seconds / max(size, 1))
+
+    def threshold(self, size: int = 1) -> Optional[float]:
+        """Returns the latency percentile for work of `size`, None until there are enough samples."""
+        if len(self._samples) < self.min_samples:
+            return None
+        samples = sorted(self._samples)
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return samples[index] * max(size, 1)
+
+    def stats(self) -> Dict:
+        threshold = self.threshold()
+        return {
+            "samples": len(self._samples),
+            "percentile": self.percentile,
+            "threshold_seconds_per_unit": round(threshold, 4) if threshold is not None else None,
+        }
+
+
+class Hedger:
+    """
+    Starts a second attempt when the first one is slower than usual.
+
+    Each attempt calls the `started` callback it is given once it holds its
+    backend slot, only the time after that is measured, so waiting in a
+    queue neither feeds the latency samples nor triggers a hedge. At most
+    `budget` of all calls are hedged, and none while `can_hedge()` says
+    there is no spare capacity. The first attempt that returns a result
+    wins, the other one is cancelled.
+    """
+
+    def __init__(self, name: str, latency: Optional[LatencyTracker] = None, enabled: bool = True,
+                 budget: float = HEDGE_BUDGET):
+        self.name = name
+        self.latency = latency or LatencyTracker()
+        self.enabled = enabled
+        self.budget = budget
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+        self.logger = logging.getLogger(__name__)
+
+    async def run(self, attempt: Callable[[int, Callable[[], None]], Awaitable[Optional[T]]], size: int = 1,
+                  can_hedge: Callable[[], bool] = lambda: True) -> Optional[T]:
+        """
+        Runs `attempt(0, started)` and, if it is slow, `attempt(1, started)` next to it.
+
+        `size` scales the hedging delay, e.g. the length of the text. Attempts
+        return None on failure, so do not raise.
+        """
+        self.calls += 1
+        started_at: Dict[int, float] = {}
+        first_started = asyncio.Event()
+
+        def started(number: int) -> Callable[[], None]:
+            def mark() -> None:
+                started_at[number] = time.monotonic()
+                if number == 0:
+                    first_started.set()
+            return mark
+
+        first = asyncio.create_task(attempt(0, started(0)))
+        numbers = {first: 0}
+        tasks = {first}
+        try:
+            delay = self.latency.threshold(size) if self.enabled else None
+            if delay is not None:
+                # The delay runs from the moment the first attempt reaches the backend
+                waiter = asyncio.create_task(first_started.wait())
+                await asyncio.wait({first, waiter}, return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    if self.hedged < self.budget * self.calls and can_hedge():
+                        self.hedged += 1
+                        self.logger.info(f"'{self.name}' slower than {delay:.2f}s, starting a hedged attempt")
+                        second = asyncio.create_task(attempt(1, started(1)))
+                        numbers[second] = 1
+                        tasks.add(second)
+                    else:
+                        self.hedges_skipped += 1
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if (result := task.result()) is not None:
+                        number = numbers[task]
+                        if number:
+                            self.hedge_wins += 1
+                        if number in started_at:
+                            self.latency.record(time.monotonic() - started_at[number], size)
+                        return result
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "budget": self.budget,
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedges_skipped": self.hedges_skipped,
+            **self.latency.stats(),
+        }
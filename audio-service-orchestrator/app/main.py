@@ -1,11 +1,24 @@
 import os
+import json
+import resource
 import logging
-from typing import List
+from contextlib import aclosing
+from typing import List, Optional
 from fastapi import FastAPI, HTTPException
-from .models import GenerateAudioRequest, GenerateAudioResponseItem
+from fastapi.responses import StreamingResponse
+from .models import (
+    GenerateAudioRequest,
+    GenerateAudioResponseItem,
+    GenerateAudioBatchRequest,
+    GenerateAudioBatchResponseItem,
+)
 from .services.audio_generation_service import AudioGenerationService
+from .services.audio_cache_service import AudioCache
+from .services.audio_postprocess_service import AudioPostProcessor
 from .clients.audio_client import AudioClient
 from .clients.audio_upload_client import AudioUploadClient
+from .clients.http_session import HttpSession
+from .clients.resilience import CircuitBreaker
 import uvicorn
 
 logging.basicConfig(
@@ -17,37 +30,167 @@ logging.basicConfig(
 app = FastAPI()
 
 APP_PORT = int(os.getenv("APP_PORT", "8000"))
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))
 
 # Initialize clients with environment variables
 audio_service_host = os.getenv('AUDIO_SERVICE_HOST', 'audio-service')
 audio_service_port = os.getenv('AUDIO_SERVICE_PORT', '8000')
 audio_upload_host = os.getenv('AUDIO_UPLOAD_SERVICE_HOST', 'yandex-disk-service')
 audio_upload_port = os.getenv('AUDIO_UPLOAD_SERVICE_PORT', '8000')
+# gTTS backend used when the primary one is unhealthy, empty to disable the fallback
+audio_fallback_host = os.getenv('AUDIO_FALLBACK_SERVICE_HOST', '')
+audio_fallback_port = os.getenv('AUDIO_FALLBACK_SERVICE_PORT', '8000')
+
+# Connection pool shared by all clients, opened on startup
+http_session = HttpSession()
 
 audio_client = AudioClient(
-    base_url=f"http://{audio_service_host}:{audio_service_port}/"
+    base_url=f"http://{audio_service_host}:{audio_service_port}/",
+    http_session=http_session,
+    circuit_breaker=CircuitBreaker("audio-service")
 )
 
 google_drive_client = AudioUploadClient(
-    base_url=f"http://{audio_upload_host}:{audio_upload_port}/"
+    base_url=f"http://{audio_upload_host}:{audio_upload_port}/",
+    http_session=http_session,
+    circuit_breaker=CircuitBreaker("audio-upload-service")
 )
 
+fallback_audio_client = AudioClient(
+    base_url=f"http://{audio_fallback_host}:{audio_fallback_port}/",
+    http_session=http_session,
+    circuit_breaker=CircuitBreaker("audio-fallback-service")
+) if audio_fallback_host else None
+
+audio_cache = AudioCache(http_session)
+
 # Initialize service
-audio_generation_service = AudioGenerationService(audio_client, google_drive_client)
+audio_postprocessor = AudioPostProcessor()
+
+audio_generation_service = AudioGenerationService(
+    audio_client, google_drive_client, audio_cache, audio_postprocessor, fallback_audio_client
+)
+
+@app.on_event("startup")
+async def on_startup():
+    await http_session.start()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await http_session.close()
+    audio_cache.close()
 
 @app.get("/health", response_model=str)
 async def get_health():
     return "OK"
 
+def select_speakers(speakers: Optional[List[str]], count: Optional[int]) -> List[str]:
+    try:
+        return audio_generation_service.select_speakers(speakers, count)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/speakers", response_model=List[str])
+async def get_speakers():
+    """
+    Lists the available speakers, the preferred one first.
+    """
+    return audio_generation_service.ordered_speakers()
+
 @app.post("/generate-audio", response_model=List[GenerateAudioResponseItem])
 async def generate_audio(request: GenerateAudioRequest):
+    """
+    Generates the preferred speaker only, unless other speakers or a count are requested.
+
+    Further voices are generated by calling again with their names or a higher
+    count, voices that are already uploaded come from the cache.
+    """
+    speakers = select_speakers(request.speakers, request.count)
     try:
-        results = await audio_generation_service.generate_audio_files(request.query)
+        results = await audio_generation_service.generate_audio_files(request.query, speakers)
         if not results:
             raise HTTPException(status_code=500, detail="Failed to generate any audio files")
         return results
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.post("/generate-audio/stream")
+async def generate_audio_stream(request: GenerateAudioRequest):
+    """
+    Streams GenerateAudioResponseItem objects as JSON lines, each one as soon as its speaker is ready.
+
+    Closing the connection cancels the speakers that are not ready yet.
+    """
+    speakers = select_speakers(request.speakers, request.count)
+
+    async def result_lines():
+        async with aclosing(audio_generation_service.iter_audio_files(request.query, speakers)) as results:
+            async for result in results:
+                yield GenerateAudioResponseItem(**result).model_dump_json() + "\n"
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+@app.post("/generate-audio/batch")
+async def generate_audio_batch(request: GenerateAudioBatchRequest):
+    """
+    Generates pronunciations of many phrases in one call.
+
+    Every requested speaker of every phrase is streamed back as a JSON line once it is done
+    or has run out of retries, followed by a summary line.
+    """
+    queries = list(dict.fromkeys(query.strip() for query in request.queries if query.strip()))
+    if not queries:
+        raise HTTPException(status_code=400, detail="No queries given")
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries per batch")
+    speakers = select_speakers(request.speakers, request.count)
+
+    async def result_lines():
+        succeeded = failed = 0
+        async with aclosing(audio_generation_service.iter_batch_audio_files(queries, speakers)) as results:
+            async for result in results:
+                if result["status"] == "ok":
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield GenerateAudioBatchResponseItem(**result).model_dump_json() + "\n"
+        yield json.dumps({"status": "done", "succeeded": succeeded, "failed": failed}) + "\n"
+
+    return StreamingResponse(result_lines(), media_type="application/x-ndjson")
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return audio_cache.stats()
+
+@app.post("/cache/validate")
+async def validate_cache():
+    return await audio_cache.validate_all()
+
+@app.get("/diagnostics/connections")
+async def get_connection_stats():
+    return http_session.stats()
+
+@app.get("/diagnostics/resilience")
+async def get_resilience_stats():
+    clients = [audio_client, google_drive_client, fallback_audio_client]
+    return {
+        "circuits": {
+            client.circuit_breaker.name: client.circuit_breaker.stats() for client in clients if client
+        },
+        "hedging": audio_generation_service.hedger.stats()
+    }
+
+@app.get("/diagnostics/postprocess")
+async def get_postprocess_stats():
+    return audio_postprocessor.stats()
+
+@app.get("/diagnostics/memory")
+async def get_memory_stats():
+    return {
+        **audio_generation_service.buffer_stats.stats(),
+        # Kilobytes on Linux
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=APP_PORT)
\ No newline at end of file
@@ -1,8 +1,25 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 class GenerateAudioRequest(BaseModel):
     query: str
+    # Speakers to generate, or the number of speakers to take in order of preference
+    speakers: Optional[List[str]] = None
+    count: Optional[int] = Field(None, ge=1)
 
 class GenerateAudioResponseItem(BaseModel):
     url: str
-    speaker: str
\ No newline at end of file
+    speaker: str
+
+class GenerateAudioBatchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1)
+    speakers: Optional[List[str]] = None
+    count: Optional[int] = Field(None, ge=1)
+
+class GenerateAudioBatchResponseItem(BaseModel):
+    query: str
+    speaker: str
+    status: str
+    url: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int
@@ -0,0 +1,173 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+from aiohttp import ClientTimeout
+
+from ..clients.http_session import HttpSession
+
+AUDIO_CACHE_PATH = os.getenv("AUDIO_CACHE_PATH", "audio-cache.sqlite3")
+AUDIO_CACHE_MAX_ENTRIES = int(os.getenv("AUDIO_CACHE_MAX_ENTRIES", "10000"))
+AUDIO_CACHE_TTL_SECONDS = float(os.getenv("AUDIO_CACHE_TTL_SECONDS", str(30 * 24 * 3600)))
+# Cached URLs older than this are checked before they are handed out again
+AUDIO_CACHE_VALIDATE_AFTER_SECONDS = float(os.getenv("AUDIO_CACHE_VALIDATE_AFTER_SECONDS", "3600"))
+AUDIO_CACHE_VALIDATE_TIMEOUT = float(os.getenv("AUDIO_CACHE_VALIDATE_TIMEOUT", "5"))
+AUDIO_CACHE_VALIDATE_CONCURRENCY = 10
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text: str, speaker: str, language: str, backend: str) -> str:
+    return hashlib.sha256(json.dumps([normalize_text(text), speaker, language, backend]).encode("utf-8")).hexdigest()
+
+
+class AudioCache:
+    """
+    Persistent map from (text, speaker, language, backend) to the URL of the uploaded audio.
+
+    Entries expire after AUDIO_CACHE_TTL_SECONDS, the least recently used ones are
+    evicted once there are more than AUDIO_CACHE_MAX_ENTRIES.
+    """
+
+    def __init__(self, http_session: HttpSession, path: str = AUDIO_CACHE_PATH, max_entries: int = AUDIO_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = AUDIO_CACHE_TTL_SECONDS,
+                 validate_after_seconds: float = AUDIO_CACHE_VALIDATE_AFTER_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.validate_after_seconds = validate_after_seconds
+        self.http_session = http_session
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS audio_cache (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                speaker TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                validated_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+            """
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS audio_cache_used_at ON audio_cache (used_at)")
+
+    async def get(self, key: str) -> Optional[str]:
+        """Returns the cached URL, checking first that it still works if it was not checked lately."""
+        entry = await asyncio.to_thread(self._get, key)
+        if entry is None:
+            self.misses += 1
+            return None
+        url, validated_at = entry
+        if time.time() - validated_at > self.validate_after_seconds:
+            if not await self.is_valid(url):
+                await asyncio.to_thread(self._delete, key)
+                self.invalidated += 1
+                self.misses += 1
+                return None
+            await asyncio.to_thread(self._mark_validated, key)
+        self.hits += 1
+        return url
+
+    async def put(self, key: str, url: str, speaker: str) -> None:
+        await asyncio.to_thread(self._put, key, url, speaker)
+
+    async def is_valid(self, url: str) -> bool:
+        # Not every storage answers HEAD requests, ask for the first byte instead
+        try:
+            async with self.http_session.session.get(
+                url,
+                headers={"Range": "bytes=0-0"},
+                allow_redirects=True,
+                timeout=ClientTimeout(total=AUDIO_CACHE_VALIDATE_TIMEOUT)
+            ) as response:
+                return response.status < 400
+        except Exception as e:
+            self.logger.warning(f"Error validating cached audio URL: {str(e)}")
+            return False
+
+    async def validate_all(self) -> Dict[str, int]:
+        """Checks every cached URL and drops the ones that stopped working."""
+        entries = await asyncio.to_thread(self._entries)
+        semaphore = asyncio.Semaphore(AUDIO_CACHE_VALIDATE_CONCURRENCY)
+
+        async def check(url: str) -> bool:
+            async with semaphore:
+                return await self.is_valid(url)
+
+        valid = await asyncio.gather(*[check(url) for _, url in entries])
+        for (key, _), is_valid in zip(entries, valid):
+            if is_valid:
+                await asyncio.to_thread(self._mark_validated, key)
+            else:
+                await asyncio.to_thread(self._delete, key)
+        self.invalidated += valid.count(False)
+        return {"checked": len(entries), "removed": valid.count(False)}
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM audio_cache").fetchone()[0]
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _get(self, key: str) -> Optional[tuple]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT url, validated_at FROM audio_cache WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl_seconds)
+            ).fetchone()
+            if row is not None:
+                self._connection.execute("UPDATE audio_cache SET used_at = ? WHERE key = ?", (now, key))
+        return row
+
+    def _put(self, key: str, url: str, speaker: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO audio_cache (key, url, speaker, created_at, validated_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, url, speaker, now, now, now)
+            )
+            self._connection.execute("DELETE FROM audio_cache WHERE created_at <= ?", (now - self.ttl_seconds,))
+            self._connection.execute(
+                "DELETE FROM audio_cache WHERE key IN "
+                "(SELECT key FROM audio_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def _mark_validated(self, key: str) -> None:
+        with self._lock:
+            self._connection.execute("UPDATE audio_cache SET validated_at = ? WHERE key = ?", (time.time(), key))
+
+    def _delete(self, key: str) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM audio_cache WHERE key = ?", (key,))
+
+    def _entries(self) -> List[tuple]:
+        with self._lock:
+            return self._connection.execute("SELECT key, url FROM audio_cache").fetchall()
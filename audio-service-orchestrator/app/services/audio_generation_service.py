@@ -1,13 +1,34 @@
 import asyncio
-from typing import List, Dict, Optional
+from contextlib import AsyncExitStack, aclosing
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Dict, Optional, Set
 from datetime import datetime
-from aiohttp import ClientSession
 import logging
 import os
 
+from .audio_cache_service import AudioCache, cache_key
+from .audio_postprocess_service import AudioPostProcessor, AudioPostProcessingError
+from ..clients.resilience import Hedger
+
 GEN_MODE_COQUI_TTS = "coqui-tts"
 GEN_MODE_GTTS = "gtts"
 GEN_MODE = os.getenv("GEN_MODE", GEN_MODE_COQUI_TTS)
+GEN_LANGUAGE = os.getenv("GEN_LANGUAGE", "es")
+
+# Concurrent calls allowed per backend, shared by all requests
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "3"))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+
+# Hedging pays off for a remote backend, a local CPU-bound XTTS would only get more work from it
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", str(GEN_MODE != GEN_MODE_COQUI_TTS)).lower() == "true"
+
+# Pipe synthesized audio straight into the upload instead of reading it into memory first
+STREAM_UPLOADS = os.getenv("STREAM_UPLOADS", "true").lower() == "true"
+
+# Batch items in progress at once across all batches, kept below TTS_CONCURRENCY so
+# that interactive requests always find a free slot
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(max(1, TTS_CONCURRENCY - 1))))
+BATCH_MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", "3"))
+BATCH_RETRY_BACKOFF_SECONDS = float(os.getenv("BATCH_RETRY_BACKOFF_SECONDS", "1"))
 
 GEN_MODE_EXTS = {
     GEN_MODE_COQUI_TTS: "wav",
@@ -19,41 +40,357 @@ GEN_MODE_SPEAKERS = {
     GEN_MODE_GTTS: ["Google Translate Text-to-Speech"],
 }
 
+# Voice generated when a request does not name any, the first one of the mode by default
+GEN_PREFERRED_SPEAKER = os.getenv("GEN_PREFERRED_SPEAKER", "")
+# Number of voices generated when a request does not name any, more are generated on request only
+GEN_DEFAULT_SPEAKER_COUNT = int(os.getenv("GEN_DEFAULT_SPEAKER_COUNT", "1"))
+
+class BufferStats:
+    """
+    Counts the audio bytes the orchestrator holds in memory.
+
+    Buffered uploads hold a whole file, streamed uploads only the chunk
+    that is being forwarded.
+    """
+
+    def __init__(self):
+        self.uploads = 0
+        self.bytes = 0
+        self.buffered_bytes = 0
+        self.peak_buffered_bytes = 0
+        self.peak_request_buffered_bytes = 0
+
+    def hold(self, size: int) -> None:
+        self.buffered_bytes += size
+        self.peak_buffered_bytes = max(self.peak_buffered_bytes, self.buffered_bytes)
+
+    def release(self, size: int) -> None:
+        self.buffered_bytes -= size
+
+    def record_upload(self, size: int, peak_buffered: int) -> None:
+        self.uploads += 1
+        self.bytes += size
+        self.peak_request_buffered_bytes = max(self.peak_request_buffered_bytes, peak_buffered)
+
+    def stats(self) -> Dict:
+        return {
+            "streaming": STREAM_UPLOADS,
+            "uploads": self.uploads,
+            "bytes": self.bytes,
+            "buffered_bytes": self.buffered_bytes,
+            "peak_buffered_bytes": self.peak_buffered_bytes,
+            "peak_request_buffered_bytes": self.peak_request_buffered_bytes,
+        }
+
+
 class AudioGenerationService:
     SPEAKERS = GEN_MODE_SPEAKERS[GEN_MODE]
 
-    def __init__(self, audio_client, audio_upload_client):
+    def __init__(self, audio_client, audio_upload_client, audio_cache: Optional[AudioCache] = None,
+                 audio_postprocessor: Optional[AudioPostProcessor] = None, fallback_audio_client=None):
         self.audio_client = audio_client
         self.audio_upload_client = audio_upload_client
+        # gTTS backend used when the primary one fails or its circuit is open
+        self.fallback_audio_client = fallback_audio_client if GEN_MODE != GEN_MODE_GTTS else None
+        self.hedger = Hedger(GEN_MODE, enabled=HEDGE_ENABLED)
+        self.audio_cache = audio_cache
+        self.audio_postprocessor = audio_postprocessor if audio_postprocessor and audio_postprocessor.enabled else None
+        self.tts_semaphore = asyncio.Semaphore(TTS_CONCURRENCY)
+        self.upload_semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+        self.batch_semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+        self.buffer_stats = BufferStats()
+        # Deletions of files left behind by cancelled uploads, referenced until they finish
+        self._cleanup_tasks: Set[asyncio.Task] = set()
+        # Fallback generations in progress by query, shared by the speakers that failed
+        self._fallback_tasks: Dict[str, asyncio.Task] = {}
         self.logger = logging.getLogger(__name__)
 
-    async def _generate_and_upload(self, session: ClientSession, query: str, speaker: str) -> Optional[Dict]:
+    async def _generate_and_upload(self, query: str, speaker: str) -> Optional[Dict]:
+        # Slow attempts are hedged with a second one while a TTS slot is free, the first to finish wins
+        if result := await self._generate_cached(
+            query, speaker, GEN_MODE,
+            lambda: self.hedger.run(
+                lambda attempt, started: self._upload(self.audio_client, GEN_MODE, query, speaker, attempt, started),
+                size=len(query),
+                can_hedge=lambda: not self.tts_semaphore.locked(),
+            )
+        ):
+            return result
+
+        self.logger.warning(f"Failed to process audio for speaker: {speaker}")
+        return None
+
+    async def _generate_fallback(self, query: str) -> Optional[Dict]:
+        """
+        Generates the query with the fallback backend.
+
+        The fallback has a single voice, so speakers that fail at the same
+        time share one generation instead of uploading the same audio each.
+        """
+        if not self.fallback_audio_client:
+            return None
+        task = self._fallback_tasks.get(query)
+        if task is None:
+            fallback_speaker = GEN_MODE_SPEAKERS[GEN_MODE_GTTS][0]
+            self.logger.warning(f"Falling back to {GEN_MODE_GTTS} for query: {query}")
+            task = asyncio.create_task(self._generate_cached(
+                query, fallback_speaker, GEN_MODE_GTTS,
+                lambda: self._upload(self.fallback_audio_client, GEN_MODE_GTTS, query, fallback_speaker)
+            ))
+            self._fallback_tasks[query] = task
+            task.add_done_callback(lambda _: self._fallback_tasks.pop(query, None))
+        # One caller giving up must not cancel the generation for the others
+        return await asyncio.shield(task)
+
+    async def _generate_cached(self, query: str, speaker: str, mode: str,
+                               upload: Callable[[], Awaitable[Optional[Dict]]]) -> Optional[Dict]:
+        key = cache_key(query, speaker, GEN_LANGUAGE, self._backend(mode))
+        if self.audio_cache and (cached_url := await self.audio_cache.get(key)):
+            return {
+                "url": cached_url,
+                "speaker": speaker
+            }
+
+        if upload_result := await upload():
+            if self.audio_cache:
+                await self.audio_cache.put(key, upload_result['url'], speaker)
+            return {
+                "url": f"{upload_result['url']}",
+                "speaker": speaker
+            }
+        return None
+
+    async def _upload(self, audio_client, mode: str, query: str, speaker: str, attempt: int = 0,
+                      started: Optional[Callable[[], None]] = None) -> Optional[Dict]:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         sanitized_query = query.replace(' ', '_')[:50]  # Limit length
         sanitized_speaker = speaker.replace(' ', '_')
-        file_name = f"{timestamp}_{sanitized_query}_{sanitized_speaker}.{GEN_MODE_EXTS[GEN_MODE]}"
+        # Hedged attempts run next to the first one and must not overwrite its file
+        suffix = f"_{attempt}" if attempt else ""
+        extension = self.audio_postprocessor.extension if self.audio_postprocessor else GEN_MODE_EXTS[mode]
+        file_name = f"{timestamp}_{sanitized_query}_{sanitized_speaker}{suffix}.{extension}"
 
-        if audio_pair := await self.audio_client.generate_audio(session, query, speaker):
-            content_type, audio_content = audio_pair
-            if upload_result := await self.audio_upload_client.upload_file(session, file_name, audio_content, content_type):
-                return {
-                    "url": f"{upload_result['url']}",
-                    "speaker": speaker
-                }
+        reached_backend = False
 
-        self.logger.warning(f"Failed to process audio for speaker: {speaker}")
-        return None
+        def mark_started() -> None:
+            nonlocal reached_backend
+            reached_backend = True
+            if started:
+                started()
+
+        try:
+            if STREAM_UPLOADS:
+                return await self._stream_upload(audio_client, query, speaker, file_name, mark_started)
+            return await self._buffered_upload(audio_client, query, speaker, file_name, mark_started)
+        except asyncio.CancelledError:
+            # A hedged attempt that lost may have stored its file already, or part of it
+            if reached_backend:
+                self._delete_upload(file_name)
+            raise
+
+    def _delete_upload(self, file_name: str) -> None:
+        task = asyncio.create_task(self.audio_upload_client.delete_file(file_name))
+        self._cleanup_tasks.add(task)
+        task.add_done_callback(self._cleanup_tasks.discard)
+
+    def ordered_speakers(self) -> List[str]:
+        """Returns the available speakers, the preferred one first."""
+        if GEN_PREFERRED_SPEAKER in self.SPEAKERS:
+            return [GEN_PREFERRED_SPEAKER] + [speaker for speaker in self.SPEAKERS if speaker != GEN_PREFERRED_SPEAKER]
+        return list(self.SPEAKERS)
+
+    def select_speakers(self, speakers: Optional[List[str]] = None, count: Optional[int] = None) -> List[str]:
+        """
+        Picks the speakers to generate: the given ones, or the first `count`
+        in order of preference. Raises ValueError for unknown speakers.
+        """
+        if speakers:
+            unknown = [speaker for speaker in speakers if speaker not in self.SPEAKERS]
+            if unknown:
+                raise ValueError(f"Unknown speakers: {unknown}")
+            return list(dict.fromkeys(speakers))
+        return self.ordered_speakers()[:count or GEN_DEFAULT_SPEAKER_COUNT]
+
+    def _backend(self, mode: str = GEN_MODE) -> str:
+        # Post-processed audio differs from what the backend returns, so it is cached separately
+        if self.audio_postprocessor:
+            return f"{mode}+{self.audio_postprocessor.output_format}"
+        return mode
+
+    async def _buffered_upload(self, audio_client, query: str, speaker: str, file_name: str,
+                               started: Optional[Callable[[], None]] = None) -> Optional[Dict]:
+        async with self.tts_semaphore:
+            if started:
+                started()
+            audio_pair = await audio_client.generate_audio(query, speaker, GEN_LANGUAGE)
+        if not audio_pair:
+            return None
+        content_type, audio_content = audio_pair
+        if self.audio_postprocessor:
+            try:
+                async with self.audio_postprocessor.process(_iter_bytes(audio_content)) as processed:
+                    audio_content = b"".join([chunk async for chunk in processed])
+            except AudioPostProcessingError as e:
+                self.logger.error(f"Error post-processing audio: {str(e)}")
+                return None
+            content_type = self.audio_postprocessor.content_type
+        size = len(audio_content)
+        self.buffer_stats.hold(size)
+        try:
+            async with self.upload_semaphore:
+                upload_result = await self.audio_upload_client.upload_file(file_name, audio_content, content_type)
+        finally:
+            self.buffer_stats.release(size)
+        if upload_result:
+            self.buffer_stats.record_upload(size, size)
+        return upload_result
+
+    async def _stream_upload(self, audio_client, query: str, speaker: str, file_name: str,
+                             started: Optional[Callable[[], None]] = None) -> Optional[Dict]:
+        # Both backends are busy for the whole transfer, so both slots are held
+        async with self.tts_semaphore, self.upload_semaphore:
+            if started:
+                started()
+            try:
+                async with AsyncExitStack() as stack:
+                    content_type, chunks = await stack.enter_async_context(
+                        audio_client.stream_audio(query, speaker, GEN_LANGUAGE)
+                    )
+                    if self.audio_postprocessor:
+                        chunks = await stack.enter_async_context(self.audio_postprocessor.process(chunks))
+                        content_type = self.audio_postprocessor.content_type
+                    relay = _ChunkRelay(chunks, self.buffer_stats)
+                    upload_result = await self.audio_upload_client.upload_stream(file_name, relay, content_type)
+            except Exception as e:
+                self.logger.error(f"Error streaming audio: {str(e)}")
+                return None
+        if upload_result:
+            self.buffer_stats.record_upload(relay.size, relay.peak_buffered)
+            self.logger.info(
+                f"Streamed {relay.size} bytes for speaker {speaker}, "
+                f"at most {relay.peak_buffered} bytes held in memory"
+            )
+        return upload_result
+
+    async def generate_audio_files(self, query: str, speakers: List[str]) -> List[Dict]:
+        """Generates the query for every speaker, or once with the fallback backend if all of them fail."""
+        tasks = [self._generate_and_upload(query, speaker) for speaker in speakers]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        successful_results = []
+        for result in results:
+            if isinstance(result, Exception):
+                self.logger.error(f"Error processing task: {str(result)}")
+            elif result is not None:
+                successful_results.append(result)
+
+        if not successful_results and (fallback_result := await self._generate_fallback(query)):
+            successful_results.append(fallback_result)
+        return successful_results
 
-    async def generate_audio_files(self, query: str) -> List[Dict]:
-        async with ClientSession() as session:
-            tasks = [self._generate_and_upload(session, query, speaker) for speaker in self.SPEAKERS]
-            results = await asyncio.gather(*tasks, return_exceptions=True)
+    async def iter_audio_files(self, query: str, speakers: List[str]) -> AsyncIterator[Dict]:
+        """
+        Yields the audio of each speaker as soon as it is uploaded, or the
+        fallback audio once if every speaker fails.
 
-            successful_results = []
-            for result in results:
+        Closing the iterator early cancels the speakers that are still in progress.
+        """
+        succeeded = False
+        async with aclosing(_iter_completed(
+            [self._generate_and_upload(query, speaker) for speaker in speakers]
+        )) as results:
+            async for result in results:
                 if isinstance(result, Exception):
                     self.logger.error(f"Error processing task: {str(result)}")
                 elif result is not None:
-                    successful_results.append(result)
+                    succeeded = True
+                    yield result
+        if not succeeded and (fallback_result := await self._generate_fallback(query)):
+            yield fallback_result
+
+    async def _generate_with_retries(self, query: str, speaker: str, max_attempts: int) -> Dict:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                async with self.batch_semaphore:
+                    result = await self._generate_and_upload(query, speaker)
+                if result:
+                    return {**result, "query": query, "status": "ok", "attempts": attempt}
+                error = "Failed to generate or upload audio"
+            except Exception as e:
+                error = str(e)
+            if attempt < max_attempts:
+                await asyncio.sleep(BATCH_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+        return {"query": query, "speaker": speaker, "status": "error", "error": error, "attempts": max_attempts}
+
+    async def iter_batch_audio_files(self, queries: List[str], speakers: List[str],
+                                     max_attempts: int = BATCH_MAX_ATTEMPTS) -> AsyncIterator[Dict]:
+        """
+        Generates the audio of the given speakers for many queries, yielding items as they complete.
+
+        Batches share BATCH_CONCURRENCY slots on top of the TTS and upload
+        semaphores, so they never take every backend slot from interactive
+        requests. An item holds a slot only while an attempt runs, a failed
+        item gives it up while it backs off before its next attempt and is
+        reported as an error once its attempts are used up. A query whose
+        speakers all failed is then generated once with the fallback backend.
+        """
+        remaining = {query: len(speakers) for query in queries}
+        succeeded = set()
+        async with aclosing(_iter_completed((
+            self._generate_with_retries(query, speaker, max_attempts)
+            for query in queries for speaker in speakers
+        ))) as results:
+            async for result in results:
+                yield result
+                query = result["query"]
+                remaining[query] -= 1
+                if result["status"] == "ok":
+                    succeeded.add(query)
+                elif not remaining[query] and query not in succeeded:
+                    if fallback_result := await self._generate_fallback(query):
+                        yield {**fallback_result, "query": query, "status": "ok", "attempts": 1}
+
+
+async def _iter_bytes(content: bytes) -> AsyncIterator[bytes]:
+    yield content
+
+
+class _ChunkRelay:
+    """Forwards audio chunks to the upload request, counting what is held in memory."""
+
+    def __init__(self, chunks: AsyncIterator[bytes], buffer_stats: BufferStats):
+        self.chunks = chunks
+        self.buffer_stats = buffer_stats
+        self.size = 0
+        self.peak_buffered = 0
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.chunks:
+            self.size += len(chunk)
+            self.peak_buffered = max(self.peak_buffered, len(chunk))
+            self.buffer_stats.hold(len(chunk))
+            try:
+                yield chunk
+            finally:
+                self.buffer_stats.release(len(chunk))
+
+
+async def _iter_completed(coroutines: Iterable) -> AsyncIterator:
+    """
+    Runs the coroutines concurrently and yields their results, or exceptions, in completion order.
 
-            return successful_results
\ No newline at end of file
+    Closing the iterator early cancels the coroutines that are still running.
+    """
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            try:
+                yield await next_result
+            except Exception as e:
+                yield e
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.getLogger(__name__).info(f"Cancelled {len(pending)} unfinished audio tasks")
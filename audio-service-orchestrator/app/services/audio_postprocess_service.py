@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import os
+import shutil
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+# Output format of the post-processing stage, empty to upload the audio as generated
+AUDIO_POSTPROCESS_FORMAT = os.getenv("AUDIO_POSTPROCESS_FORMAT", "mp3")
+AUDIO_POSTPROCESS_BITRATE = os.getenv("AUDIO_POSTPROCESS_BITRATE", "48k")
+AUDIO_POSTPROCESS_SAMPLE_RATE = int(os.getenv("AUDIO_POSTPROCESS_SAMPLE_RATE", "24000"))
+# ffmpeg processes running at once, kept small because the host shares its CPU with XTTS
+AUDIO_POSTPROCESS_WORKERS = int(os.getenv("AUDIO_POSTPROCESS_WORKERS", "2"))
+AUDIO_SILENCE_THRESHOLD = os.getenv("AUDIO_SILENCE_THRESHOLD", "-50dB")
+# Longest silence kept, in seconds, longer pauses and the trailing silence are shortened to it
+AUDIO_MAX_SILENCE = float(os.getenv("AUDIO_MAX_SILENCE", "0.5"))
+AUDIO_LOUDNORM = os.getenv("AUDIO_LOUDNORM", "I=-16:TP=-1.5:LRA=11")
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+
+PIPE_READ_SIZE = 64 * 1024
+
+POSTPROCESS_FORMATS = {
+    # format: (extension, content type, ffmpeg encoder, ffmpeg muxer)
+    "mp3": ("mp3", "audio/mpeg", "libmp3lame", "mp3"),
+    "opus": ("ogg", "audio/ogg", "libopus", "ogg"),
+}
+
+# Trims leading silence, shortens every later one, the trailing silence included, then
+# normalizes loudness. Both filters work on a sliding window, the audio is never reversed
+SILENCE_TRIM = (
+    f"silenceremove=start_periods=1:start_threshold={AUDIO_SILENCE_THRESHOLD}"
+    f":stop_periods=-1:stop_threshold={AUDIO_SILENCE_THRESHOLD}"
+    f":stop_duration={AUDIO_MAX_SILENCE}:stop_silence={AUDIO_MAX_SILENCE}"
+)
+AUDIO_FILTER = f"{SILENCE_TRIM},loudnorm={AUDIO_LOUDNORM}"
+
+
+class AudioPostProcessingError(Exception):
+    pass
+
+
+class AudioPostProcessor:
+    """
+    Trims silence, normalizes loudness and compresses audio before it is uploaded.
+
+    Every file is piped through its own ffmpeg process, at most `workers`
+    of them run at the same time. Input and output are streamed, so the
+    event loop is never blocked. ffmpeg only holds the few seconds of
+    lookahead loudnorm needs, so the output starts while the input is
+    still being synthesized.
+    """
+
+    def __init__(self, output_format: str = AUDIO_POSTPROCESS_FORMAT, bitrate: str = AUDIO_POSTPROCESS_BITRATE,
+                 sample_rate: int = AUDIO_POSTPROCESS_SAMPLE_RATE, workers: int = AUDIO_POSTPROCESS_WORKERS,
+                 ffmpeg_path: str = FFMPEG_PATH):
+        if output_format and output_format not in POSTPROCESS_FORMATS:
+            raise ValueError(f"Unsupported post-processing format: {output_format}")
+        self.logger = logging.getLogger(__name__)
+        self.output_format = output_format
+        if output_format and shutil.which(ffmpeg_path) is None:
+            self.logger.warning(f"'{ffmpeg_path}' not found, audio is uploaded without post-processing")
+            self.output_format = ""
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.workers = workers
+        self.ffmpeg_path = ffmpeg_path
+        self.semaphore = asyncio.Semaphore(workers)
+        self.files = 0
+        self.failed = 0
+        self.input_bytes = 0
+        self.output_bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.output_format)
+
+    @property
+    def extension(self) -> str:
+        return POSTPROCESS_FORMATS[self.output_format][0]
+
+    @property
+    def content_type(self) -> str:
+        return POSTPROCESS_FORMATS[self.output_format][1]
+
+    def _command(self):
+        _, _, encoder, muxer = POSTPROCESS_FORMATS[self.output_format]
+        return [
+            self.ffmpeg_path, "-hide_banner", "-loglevel", "error",
+            "-i", "pipe:0",
+            "-af", AUDIO_FILTER,
+            "-ar", str(self.sample_rate),
+            "-ac", "1",
+            "-c:a", encoder,
+            "-b:a", self.bitrate,
+            "-f", muxer,
+            "pipe:1",
+        ]
+
+    @asynccontextmanager
+    async def process(self, chunks: AsyncIterator[bytes]) -> AsyncIterator[AsyncIterator[bytes]]:
+        """
+        Starts an ffmpeg process fed with the given chunks.
+
+        Yields an iterator over the processed audio, which raises
+        AudioPostProcessingError at the end if ffmpeg failed.
+        """
+        async with self.semaphore:
+            process = await asyncio.create_subprocess_exec(
+                *self._command(),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            counts = {"input": 0, "output": 0}
+            feeder = asyncio.create_task(self._feed(process, chunks, counts))
+            try:
+                yield self._read(process, feeder, counts)
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                if not feeder.done():
+                    feeder.cancel()
+
+    async def _feed(self, process: asyncio.subprocess.Process, chunks: AsyncIterator[bytes], counts: Dict) -> None:
+        try:
+            async for chunk in chunks:
+                counts["input"] += len(chunk)
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            # ffmpeg exited early, its error is reported by the reader
+            pass
+        finally:
+            process.stdin.close()
+
+    async def _read(self, process: asyncio.subprocess.Process, feeder: asyncio.Task,
+                    counts: Dict) -> AsyncIterator[bytes]:
+        while chunk := await process.stdout.read(PIPE_READ_SIZE):
+            counts["output"] += len(chunk)
+            yield chunk
+        await feeder
+        stderr = await process.stderr.read()
+        if await process.wait() != 0:
+            self.failed += 1
+            raise AudioPostProcessingError(
+                f"ffmpeg exited with code {process.returncode}: {stderr.decode(errors='replace').strip()}"
+            )
+        self.files += 1
+        self.input_bytes += counts["input"]
+        self.output_bytes += counts["output"]
+        self.logger.info(
+            f"Post-processed audio from {counts['input']} to {counts['output']} bytes ({self.output_format})"
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "format": self.output_format or None,
+            "bitrate": self.bitrate if self.enabled else None,
+            "workers": self.workers,
+            "files": self.files,
+            "failed": self.failed,
+            "input_bytes": self.input_bytes,
+            "output_bytes": self.output_bytes,
+            "ratio": round(self.output_bytes / self.input_bytes, 3) if self.input_bytes else None,
+        }
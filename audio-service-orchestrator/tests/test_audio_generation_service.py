@@ -0,0 +1,35 @@
+import asyncio
+import time
+from contextlib import aclosing
+
+from app.services import audio_generation_service
+from app.services.audio_generation_service import AudioGenerationService
+
+
+def test_batch_item_backing_off_frees_its_slot(monkeypatch):
+    monkeypatch.setattr(audio_generation_service, "BATCH_RETRY_BACKOFF_SECONDS", 0.2)
+    service = AudioGenerationService(audio_client=None, audio_upload_client=None)
+    service.batch_semaphore = asyncio.Semaphore(1)
+    attempts = []
+
+    async def generate_and_upload(query, speaker):
+        attempts.append(query)
+        if query == "flaky" and attempts.count("flaky") == 1:
+            return None
+        return {"speaker": speaker, "url": f"https://audio/{query}"}
+
+    service._generate_and_upload = generate_and_upload
+
+    async def run():
+        started = time.monotonic()
+        finished = {}
+        async with aclosing(service.iter_batch_audio_files(["flaky", "ok"], ["speaker"])) as results:
+            async for result in results:
+                finished[result["query"]] = (result["status"], result["attempts"], time.monotonic() - started)
+        return finished
+
+    finished = asyncio.run(run())
+    assert finished["flaky"][:2] == ("ok", 2)
+    assert finished["ok"][:2] == ("ok", 1)
+    # The second item ran while the first one was backing off
+    assert finished["ok"][2] < 0.1
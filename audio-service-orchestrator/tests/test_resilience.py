@@ -0,0 +1,163 @@
+import asyncio
+
+from aiohttp import ClientConnectionError
+
+from app.clients.resilience import (
+    CIRCUIT_CLOSED,
+    CIRCUIT_HALF_OPEN,
+    CIRCUIT_OPEN,
+    CircuitBreaker,
+    Hedger,
+    LatencyTracker,
+)
+
+
+def test_circuit_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("tts", failure_threshold=3, reset_seconds=60)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_half_open_circuit_lets_one_trial_through():
+    breaker = CircuitBreaker("tts", failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    assert breaker.state == CIRCUIT_HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CIRCUIT_CLOSED
+    assert breaker.allow()
+
+
+def test_failed_trial_reopens_the_circuit():
+    breaker = CircuitBreaker("tts", failure_threshold=5, reset_seconds=0)
+    for _ in range(5):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CIRCUIT_OPEN
+
+
+def test_client_errors_do_not_count_as_failures():
+    breaker = CircuitBreaker("tts", failure_threshold=1, reset_seconds=60)
+    breaker.record_error(ValueError("bad request"))
+    assert breaker.state == CIRCUIT_CLOSED
+    breaker.record_error(ClientConnectionError())
+    assert breaker.state == CIRCUIT_OPEN
+
+
+def warm_tracker(seconds_per_unit: float) -> LatencyTracker:
+    tracker = LatencyTracker(window=10, percentile=95, min_samples=5)
+    for _ in range(5):
+        tracker.record(seconds_per_unit * 10, size=10)
+    return tracker
+
+
+def attempt_taking(*durations: float):
+    """Attempt whose n-th run takes durations[n] seconds and returns n."""
+    async def attempt(number, started):
+        started()
+        await asyncio.sleep(durations[number])
+        return number
+    return attempt
+
+
+def test_latency_threshold_scales_with_size():
+    tracker = warm_tracker(0.01)
+    assert tracker.threshold(size=1) == 0.01
+    assert tracker.threshold(size=50) == 0.5
+    assert LatencyTracker(min_samples=5).threshold() is None
+
+
+def test_slow_attempt_is_hedged():
+    hedger = Hedger("tts", warm_tracker(0.001), budget=1)
+    assert asyncio.run(hedger.run(attempt_taking(1, 0), size=10)) == 1
+    assert hedger.stats()["hedged"] == 1
+    assert hedger.stats()["hedge_wins"] == 1
+
+
+def test_fast_attempt_is_not_hedged():
+    hedger = Hedger("tts", warm_tracker(0.01), budget=1)
+    assert asyncio.run(hedger.run(attempt_taking(0, 0), size=10)) == 0
+    assert hedger.stats()["hedged"] == 0
+
+
+def test_no_hedge_without_spare_capacity_or_budget():
+    hedger = Hedger("tts", warm_tracker(0.001), budget=1)
+    assert asyncio.run(hedger.run(attempt_taking(0.05, 0), size=10, can_hedge=lambda: False)) == 0
+
+    hedger = Hedger("tts", warm_tracker(0.001), budget=0)
+    assert asyncio.run(hedger.run(attempt_taking(0.05, 0), size=10)) == 0
+    assert hedger.stats()["hedges_skipped"] == 1
+
+
+def test_disabled_hedger_runs_once():
+    hedger = Hedger("tts", warm_tracker(0.001), enabled=False)
+    assert asyncio.run(hedger.run(attempt_taking(0.05, 0), size=10)) == 0
+    assert hedger.stats()["hedged"] == 0
+
+
+def test_waiting_for_a_slot_is_not_measured():
+    tracker = warm_tracker(0.01)
+    hedger = Hedger("tts", tracker, budget=1)
+    slot = asyncio.Semaphore(1)
+
+    async def attempt(number, started):
+        async with slot:
+            started()
+            await asyncio.sleep(0.01)
+            return number
+
+    async def run():
+        # The slot is taken for longer than the hedging delay of 0.1s
+        async with slot:
+            call = asyncio.create_task(hedger.run(attempt, size=10))
+            await asyncio.sleep(0.2)
+        return await call
+
+    assert asyncio.run(run()) == 0
+    assert hedger.stats()["hedged"] == 0
+    # Only the 10ms of work were recorded, 1ms per unit
+    assert tracker.threshold(size=1) == 0.01
+    assert min(tracker._samples) < 0.005
+
+
+def test_loser_is_cancelled():
+    cancelled = []
+
+    async def attempt(number, started):
+        started()
+        try:
+            await asyncio.sleep(1 if number == 0 else 0)
+        except asyncio.CancelledError:
+            cancelled.append(number)
+            raise
+        return number
+
+    async def run():
+        result = await Hedger("tts", warm_tracker(0.001), budget=1).run(attempt, size=10)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == 1
+    assert cancelled == [0]
+
+
+def test_failed_attempts_return_none():
+    async def attempt(number, started):
+        return None
+
+    hedger = Hedger("tts", warm_tracker(0.001))
+    assert asyncio.run(hedger.run(attempt)) is None
+    assert hedger.latency.stats()["samples"] == 5
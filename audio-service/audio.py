@@ -1,30 +1,324 @@
 from fastapi import FastAPI, HTTPException, Response, Query
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import uvicorn
 import os
 import io
+import struct
+import threading
+import time
+import wave
+import zipfile
+from collections import deque
+from contextlib import aclosing
+from typing import Any, Callable, Dict, Iterator, List, Tuple
 
+import numpy as np
 import torch
 from TTS.api import TTS
 
+from inference_pool import InferencePool, InferenceQueueFull
+
 os.environ["COQUI_TOS_AGREED"] = "1"
 
 APP_PORT = int(os.getenv("APP_PORT", default="8000"))
+# Speakers whose conditioning latents are prepared at startup, others are prepared on first use
+PRELOAD_SPEAKERS = [
+    speaker.strip()
+    for speaker in os.getenv("PRELOAD_SPEAKERS", "Craig Gutsy,Maja Ruoho,Barbora MacLean").split(",")
+    if speaker.strip()
+]
+# Conditioning latents are saved here and loaded back on the next start
+SPEAKER_LATENTS_PATH = os.getenv("SPEAKER_LATENTS_PATH", "speaker_latents.pth")
+# Optional folder with "<speaker>.wav" reference clips for voices XTTS does not ship
+SPEAKER_WAV_DIR = os.getenv("SPEAKER_WAV_DIR", "")
+# GPT tokens per streamed chunk, smaller chunks start playing sooner but synthesize slower
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", default="20"))
+# Streamed requests whose time to first byte and real-time factor are kept for /metrics
+STREAM_METRICS_WINDOW = int(os.getenv("STREAM_METRICS_WINDOW", default="100"))
+# "fp32" runs the model as shipped, "int8" quantizes the GPT layers dynamically on CPU
+INFERENCE_PROFILE = os.getenv("INFERENCE_PROFILE", default="fp32")
+# Threads used inside one operation and across independent operations, 0 keeps the torch defaults
+TORCH_INTRAOP_THREADS = int(os.getenv("TORCH_INTRAOP_THREADS", default="0"))
+TORCH_INTEROP_THREADS = int(os.getenv("TORCH_INTEROP_THREADS", default="0"))
+INFERENCE_PROFILES = ("fp32", "int8")
 app = FastAPI()
 
+if INFERENCE_PROFILE not in INFERENCE_PROFILES:
+    raise ValueError(f"Unsupported inference profile: {INFERENCE_PROFILE}, expected one of {INFERENCE_PROFILES}")
+# Inter-op threads can only be set before torch runs anything in parallel
+if TORCH_INTEROP_THREADS:
+    torch.set_interop_threads(TORCH_INTEROP_THREADS)
+if TORCH_INTRAOP_THREADS:
+    torch.set_num_threads(TORCH_INTRAOP_THREADS)
+
 device = "cuda" if torch.cuda.is_available() else "cpu"
 tts = TTS(model_name="tts_models/multilingual/multi-dataset/xtts_v2").to(device)
 
 print(tts.list_models())
 print(tts.speakers)
 
+model = tts.synthesizer.tts_model
+
+
+def quantize_gpt(xtts) -> None:
+    """
+    Replaces the linear layers of the XTTS GPT with dynamically quantized int8 ones, in place.
+
+    GPT-2 blocks keep their projections in transformers' Conv1D, which is a
+    transposed linear layer, so those are turned into nn.Linear first. The
+    HiFi-GAN decoder is convolutional and stays in full precision.
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    def to_linear(module: torch.nn.Module) -> None:
+        for name, child in module.named_children():
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = torch.nn.Linear(in_features, out_features)
+                linear.weight = torch.nn.Parameter(child.weight.t().contiguous())
+                linear.bias = child.bias
+                setattr(module, name, linear)
+            else:
+                to_linear(child)
+
+    # The inference wrapper shares the transformer blocks, so both see the quantized layers
+    to_linear(xtts.gpt)
+    torch.ao.quantization.quantize_dynamic(xtts.gpt, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+if INFERENCE_PROFILE == "int8":
+    if device == "cpu":
+        quantize_gpt(model)
+    else:
+        print("int8 inference profile is CPU only, running the model in full precision")
+print(f"Inference profile: {INFERENCE_PROFILE}, device: {device}, threads: "
+      f"{torch.get_num_threads()} intra-op, {torch.get_num_interop_threads()} inter-op")
+SAMPLE_RATE = model.config.audio.output_sample_rate
+
+# The same tuning knobs TTS.api uses for XTTS
+INFERENCE_SETTINGS = {
+    "temperature": model.config.temperature,
+    "length_penalty": model.config.length_penalty,
+    "repetition_penalty": model.config.repetition_penalty,
+    "top_k": model.config.top_k,
+    "top_p": model.config.top_p,
+    "enable_text_splitting": True,
+}
+
+
+def conditioning_latents(speaker_wav: str) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Computes the GPT conditioning latent and speaker embedding of a reference clip."""
+    return model.get_conditioning_latents(
+        audio_path=[speaker_wav],
+        gpt_cond_len=model.config.gpt_cond_len,
+        gpt_cond_chunk_len=model.config.gpt_cond_chunk_len,
+        max_ref_length=model.config.max_ref_len,
+        sound_norm_refs=model.config.sound_norm_refs,
+    )
+
+
+class SpeakerLatentsCache:
+    """
+    GPT conditioning latents and speaker embeddings, prepared once per speaker.
+
+    Built-in XTTS speakers are taken from the speaker manager, other speakers are
+    computed from "<speaker>.wav" in SPEAKER_WAV_DIR. The cache is saved with
+    torch.save and loaded back on the next start.
+    """
+
+    def __init__(self, path: str = SPEAKER_LATENTS_PATH):
+        self.path = path
+        self._latents: Dict[str, Tuple[torch.Tensor, torch.Tensor]] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        stored = torch.load(self.path, map_location=device)
+        self._latents = {
+            speaker: (latents["gpt_cond_latent"], latents["speaker_embedding"])
+            for speaker, latents in stored.items()
+        }
+        print(f"Loaded conditioning latents of {len(self._latents)} speakers from {self.path}")
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        torch.save({
+            speaker: {"gpt_cond_latent": gpt_cond_latent.cpu(), "speaker_embedding": speaker_embedding.cpu()}
+            for speaker, (gpt_cond_latent, speaker_embedding) in self._latents.items()
+        }, self.path)
+
+    def get(self, speaker: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Returns the latents of a speaker, raises KeyError for unknown speakers."""
+        if speaker in self._latents:
+            return self._latents[speaker]
+        with self._lock:
+            if speaker not in self._latents:
+                self._latents[speaker] = self._compute(speaker)
+                self.save()
+            return self._latents[speaker]
+
+    def _compute(self, speaker: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        speaker_wav = os.path.join(SPEAKER_WAV_DIR, f"{speaker}.wav") if SPEAKER_WAV_DIR else None
+        if speaker_wav and os.path.exists(speaker_wav):
+            return conditioning_latents(speaker_wav)
+        if speaker in model.speaker_manager.speakers:
+            latents = model.speaker_manager.speakers[speaker]
+            return latents["gpt_cond_latent"].to(device), latents["speaker_embedding"].to(device)
+        raise KeyError(speaker)
+
+    def cached(self, speaker: str) -> bool:
+        return speaker in self._latents
+
+    def speakers(self):
+        return list(self._latents)
+
+
+class StreamMetrics:
+    """Time to first byte and real-time factor of recent streamed requests."""
+
+    def __init__(self, window: int = STREAM_METRICS_WINDOW):
+        self.streams = 0
+        self._recent = deque(maxlen=window)
+
+    def record(self, ttfb: float, real_time_factor: float) -> None:
+        self.streams += 1
+        self._recent.append((ttfb, real_time_factor))
+
+    def stats(self) -> Dict[str, Any]:
+        if not self._recent:
+            return {"streams": self.streams, "avg_ttfb_ms": None, "avg_real_time_factor": None}
+        return {
+            "streams": self.streams,
+            "avg_ttfb_ms": round(sum(ttfb for ttfb, _ in self._recent) / len(self._recent) * 1000, 1),
+            "avg_real_time_factor": round(sum(rtf for _, rtf in self._recent) / len(self._recent), 3),
+        }
+
+
+speaker_latents = SpeakerLatentsCache()
+inference_pool = InferencePool()
+stream_metrics = StreamMetrics()
+for preload_speaker in PRELOAD_SPEAKERS:
+    speaker_latents.get(preload_speaker)
+
+
+def synthesize(text: str, language: str, speaker: str) -> bytes:
+    """Runs XTTS against the cached latents of the speaker and returns a WAV file."""
+    return synthesize_with_latents(text, language, speaker_latents.get(speaker))
+
+
+def synthesize_with_latents(text: str, language: str, latents: Tuple[torch.Tensor, torch.Tensor]) -> bytes:
+    """Runs XTTS against the given latents and returns a peak-normalized WAV file."""
+    gpt_cond_latent, speaker_embedding = latents
+    with torch.inference_mode():
+        output = model.inference(text, language, gpt_cond_latent, speaker_embedding, **INFERENCE_SETTINGS)
+
+    wav_data = io.BytesIO()
+    with wave.open(wav_data, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(to_pcm16(output["wav"], normalize=True))
+    return wav_data.getvalue()
+
+
+def synthesize_stream(text: str, language: str, speaker: str) -> Iterator[bytes]:
+    """Runs XTTS incrementally, yields 16-bit PCM chunks as soon as they are synthesized."""
+    gpt_cond_latent, speaker_embedding = speaker_latents.get(speaker)
+    with torch.inference_mode():
+        for chunk in model.inference_stream(text, language, gpt_cond_latent, speaker_embedding,
+                                            stream_chunk_size=STREAM_CHUNK_SIZE, **INFERENCE_SETTINGS):
+            yield to_pcm16(chunk.cpu().numpy())
+
+
+def to_pcm16(samples, normalize: bool = False) -> bytes:
+    samples = np.asarray(samples, dtype=np.float32)
+    if normalize:
+        # Peak normalization as in TTS's save_wav, so files sound as loud as with tts_to_file.
+        # Streamed chunks are converted before the peak of the whole clip is known, they are only clipped
+        samples = samples / max(0.01, float(np.max(np.abs(samples))))
+    samples = np.clip(samples, -1.0, 1.0)
+    return (samples * 32767).astype(np.int16).tobytes()
+
+
+def streaming_wav_header() -> bytes:
+    """WAV header of a mono 16-bit stream whose length is not known yet, players read until the end."""
+    unknown_size = 0xFFFFFFFF
+    return (
+        b"RIFF" + struct.pack("<I", unknown_size) + b"WAVE"
+        + b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16)
+        + b"data" + struct.pack("<I", unknown_size)
+    )
+
+
+def synthesize_archive(text: str, language: str, speakers: List[str]) -> bytes:
+    """Synthesizes the text with every speaker into a zip archive of WAV files."""
+    archive = io.BytesIO()
+    # WAV barely compresses, storing the files keeps the archive cheap to build
+    with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_STORED) as zip_file:
+        for speaker in speakers:
+            zip_file.writestr(speaker_file_name(speaker), synthesize(text, language, speaker))
+    return archive.getvalue()
+
+
+def queue_full_error(error: InferenceQueueFull) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(error), headers={"Retry-After": str(error.retry_after)})
+
+
+def load_speakers(speakers: List[str]) -> None:
+    for speaker in speakers:
+        speaker_latents.get(speaker)
+
+
+async def prepare_speakers(speakers: List[str]) -> None:
+    """
+    Makes sure the latents of the speakers are cached, raises 400 for unknown speakers.
+
+    Latents of a new voice are computed from its reference clip and saved to
+    disk, which takes seconds, so it runs in the inference pool instead of
+    on the event loop.
+    """
+    missing = [speaker for speaker in speakers if not speaker_latents.cached(speaker)]
+    if not missing:
+        return
+    try:
+        await inference_pool.run(load_speakers, missing)
+    except InferenceQueueFull as e:
+        raise queue_full_error(e)
+    except KeyError as e:
+        raise HTTPException(status_code=400, detail=f"Unknown speaker: {e.args[0]}")
+
+
+async def run_inference(function: Callable[..., bytes], *args) -> Tuple[bytes, Dict[str, str]]:
+    """Runs synthesis in the inference pool, returns the audio and its timing headers."""
+    try:
+        audio_data, timing = await inference_pool.run(function, *args)
+    except InferenceQueueFull as e:
+        raise queue_full_error(e)
+    return audio_data, {
+        "X-Queue-Depth": str(timing["queue_depth"]),
+        "X-Queue-Wait-Ms": str(round(timing["wait"] * 1000)),
+        "X-Compute-Ms": str(round(timing["compute"] * 1000)),
+    }
+
 
 @app.get("/health")
 def get_health():
     return "OK"
 
 
+@app.get("/metrics")
+def get_metrics():
+    return {
+        **inference_pool.stats(),
+        "profile": INFERENCE_PROFILE,
+        "streaming": stream_metrics.stats(),
+    }
+
+
 class GenerateAudioRequest(BaseModel):
     query: str
     lang: str = "es"
@@ -40,17 +334,96 @@ class GenerateAudioRequest(BaseModel):
 # Annmarie Nele
 # Ana Florence
 
+class GenerateAudioBatchRequest(BaseModel):
+    query: str
+    lang: str = "es"
+    speakers: List[str] = Field(..., min_length=1)
+
+
+def speaker_file_name(speaker: str) -> str:
+    return f"{speaker.replace(' ', '_')}.wav"
+
+
+@app.get("/speakers")
+def get_speakers():
+    """Lists the speakers whose conditioning latents are cached."""
+    return speaker_latents.speakers()
+
+
 @app.post("/generate")
 async def generate(request: GenerateAudioRequest):
-    audio_data = io.BytesIO()
-    tts.tts_to_file(
-        text=request.query,
-        file_path=audio_data,
-        language=request.lang,
-        speaker=request.speaker
+    """
+    Synthesizes the text in the inference pool.
+
+    Returns 429 with Retry-After while the pool is busy, timing is
+    reported in the X-Queue-Wait-Ms and X-Compute-Ms headers.
+    """
+    await prepare_speakers([request.speaker])
+
+    audio_data, headers = await run_inference(synthesize, request.query, request.lang, request.speaker)
+    return Response(audio_data, media_type="audio/wav", headers=headers)
+
+
+@app.post("/generate/stream")
+async def generate_stream(request: GenerateAudioRequest):
+    """
+    Streams the synthesized text as a WAV file, chunk by chunk as XTTS produces it.
+
+    Time to first byte and real-time factor are logged per request and
+    summarized in /metrics, they are not known yet when headers are sent.
+    """
+    started = time.monotonic()
+    await prepare_speakers([request.speaker])
+
+    try:
+        chunks, timing = inference_pool.stream(synthesize_stream, request.query, request.lang, request.speaker)
+    except InferenceQueueFull as e:
+        raise queue_full_error(e)
+
+    async def wav_stream():
+        ttfb = None
+        audio_bytes = 0
+        async with aclosing(chunks):
+            async for chunk in chunks:
+                if ttfb is None:
+                    ttfb = time.monotonic() - started
+                    yield streaming_wav_header()
+                audio_bytes += len(chunk)
+                yield chunk
+        if ttfb is None:
+            yield streaming_wav_header()
+            return
+        audio_seconds = audio_bytes / 2 / SAMPLE_RATE
+        real_time_factor = timing["compute"] / audio_seconds if audio_seconds else 0.0
+        stream_metrics.record(ttfb, real_time_factor)
+        print(f"Streamed {audio_seconds:.2f}s of audio, ttfb {ttfb * 1000:.0f}ms, "
+              f"wait {timing['wait'] * 1000:.0f}ms, real-time factor {real_time_factor:.3f}")
+
+    return StreamingResponse(
+        wav_stream(),
+        media_type="audio/wav",
+        headers={"X-Queue-Depth": str(timing["queue_depth"])}
     )
 
-    return StreamingResponse(audio_data, media_type="audio/wav")
+
+@app.post("/generate/speakers")
+async def generate_speakers(request: GenerateAudioBatchRequest):
+    """
+    Synthesizes one text with several speakers and returns a zip archive with a WAV file per speaker.
+
+    Speakers run one after another in a single inference worker instead of
+    competing for the cores as separate requests would. Entries are named
+    after the speaker, spaces replaced with underscores.
+    """
+    speakers = list(dict.fromkeys(request.speakers))
+    await prepare_speakers(speakers)
+
+    archive, headers = await run_inference(synthesize_archive, request.query, request.lang, speakers)
+    return Response(
+        archive,
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="speakers.zip"', **headers}
+    )
 
 
 if __name__ == "__main__":
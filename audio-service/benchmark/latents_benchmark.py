@@ -0,0 +1,84 @@
+"""
+Synthesis latency benchmark for the audio service.
+
+Compares the former TTS.api path (tts_to_file with a speaker name) with
+synthesis against the cached conditioning latents, in the same process and
+on the same device. Run it inside the audio-service container:
+
+    python benchmark/latents_benchmark.py --runs 20 --speaker "Craig Gutsy" --text "¿Dónde está la estación?"
+
+Custom voices from SPEAKER_WAV_DIR can be compared with --speaker-wav, which
+makes the baseline compute the latents from the reference clip on every call,
+while the cached path computes them from the same clip once up front.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio  # noqa: E402  loads the model and the latents cache
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(percent / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def measure(run: Callable[[], None], runs: int, warmup: int) -> Dict[str, float]:
+    for _ in range(warmup):
+        run()
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - started)
+    return {
+        "runs": runs,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--speaker", default="Craig Gutsy")
+    parser.add_argument("--speaker-wav", default=None, help="Reference clip, for voices outside XTTS")
+    parser.add_argument("--language", default="es")
+    parser.add_argument("--text", default="¿Dónde está la estación de tren?")
+    args = parser.parse_args()
+
+    def baseline() -> None:
+        if args.speaker_wav:
+            audio.tts.tts_to_file(text=args.text, file_path=io.BytesIO(), language=args.language,
+                                  speaker_wav=args.speaker_wav)
+        else:
+            audio.tts.tts_to_file(text=args.text, file_path=io.BytesIO(), language=args.language,
+                                  speaker=args.speaker)
+
+    # Both paths must synthesize the same voice, a clip replaces the named speaker
+    latents = audio.conditioning_latents(args.speaker_wav) if args.speaker_wav else audio.speaker_latents.get(args.speaker)
+
+    def cached_latents() -> None:
+        audio.synthesize_with_latents(args.text, args.language, latents)
+
+    results = {
+        "device": audio.device,
+        "speaker": args.speaker_wav or args.speaker,
+        "text": args.text,
+        "tts_to_file": measure(baseline, args.runs, args.warmup),
+        "cached_latents": measure(cached_latents, args.runs, args.warmup),
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""
+Inference profile benchmark for the audio service.
+
+Synthesizes a fixed phrase set under every inference profile and reports the
+real-time factor (synthesis time divided by audio duration), memory and the
+similarity of the audio to the one of the first profile. Each profile runs in
+its own process, because the profile and the thread settings are applied when
+the model is loaded. Run it inside the audio-service container:
+
+    python benchmark/profile_benchmark.py --profiles fp32,int8 --threads 4 --output /tmp/profiles
+
+Similarity is the cosine similarity of XTTS speaker embeddings, computed
+with the fp32 model, and the ratio of audio durations. Synthesis samples
+tokens, so even two fp32 runs do not produce identical audio, --seed keeps
+the comparison repeatable.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import wave
+from typing import Dict, List
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+PHRASES = [
+    "Hola.",
+    "¿Dónde está la estación de tren?",
+    "Me gustaría reservar una mesa para dos personas esta noche.",
+    "Aunque llovía mucho, decidimos salir a caminar por el parque antes de la cena.",
+    "El ayuntamiento anunció que las obras de la biblioteca terminarán a finales del próximo año.",
+]
+
+
+def percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    index = min(int(round(percent / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def read_wav(path: str) -> np.ndarray:
+    with wave.open(path, "rb") as wav_file:
+        frames = wav_file.readframes(wav_file.getnframes())
+    return np.frombuffer(frames, dtype=np.int16).astype(np.float32) / 32767
+
+
+def run_profile(args: argparse.Namespace) -> None:
+    """Loads the model with the profile from the environment and synthesizes the phrases."""
+    import torch
+    import audio  # noqa: E402  loads the model with INFERENCE_PROFILE
+
+    rss_after_load = peak_rss_mb()
+    output_dir = os.path.join(args.output, audio.INFERENCE_PROFILE)
+    os.makedirs(output_dir, exist_ok=True)
+    for _ in range(args.warmup):
+        audio.synthesize(PHRASES[0], args.language, args.speaker)
+
+    factors = []
+    for index, phrase in enumerate(PHRASES):
+        for run in range(args.runs):
+            torch.manual_seed(args.seed + run)
+            started = time.perf_counter()
+            wav_data = audio.synthesize(phrase, args.language, args.speaker)
+            elapsed = time.perf_counter() - started
+            audio_seconds = (len(wav_data) - 44) / 2 / audio.SAMPLE_RATE
+            factors.append(elapsed / audio_seconds)
+            if run == 0:
+                with open(os.path.join(output_dir, f"{index}.wav"), "wb") as wav_file:
+                    wav_file.write(wav_data)
+
+    print(json.dumps({
+        "profile": audio.INFERENCE_PROFILE,
+        "device": audio.device,
+        "intra_op_threads": torch.get_num_threads(),
+        "inter_op_threads": torch.get_num_interop_threads(),
+        "real_time_factor_p50": round(percentile(factors, 50), 3),
+        "real_time_factor_p95": round(percentile(factors, 95), 3),
+        "rss_after_load_mb": rss_after_load,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def compare(args: argparse.Namespace, profiles: List[str]) -> None:
+    """Compares the audio of every profile with the audio of the first one."""
+    import torch
+    import audio  # noqa: E402  the fp32 model serves as the similarity reference
+
+    def embedding(samples: np.ndarray) -> torch.Tensor:
+        with torch.inference_mode():
+            tensor = torch.from_numpy(samples).unsqueeze(0)
+            return audio.model.get_speaker_embedding(tensor, audio.SAMPLE_RATE).flatten()
+
+    reference, *others = profiles
+    similarity = {}
+    for profile in others:
+        cosines, duration_ratios = [], []
+        for index in range(len(PHRASES)):
+            expected = read_wav(os.path.join(args.output, reference, f"{index}.wav"))
+            actual = read_wav(os.path.join(args.output, profile, f"{index}.wav"))
+            cosines.append(torch.nn.functional.cosine_similarity(embedding(expected), embedding(actual), dim=0).item())
+            duration_ratios.append(len(actual) / len(expected))
+        similarity[profile] = {
+            "speaker_similarity_mean": round(float(np.mean(cosines)), 3),
+            "speaker_similarity_min": round(float(np.min(cosines)), 3),
+            "duration_ratio_mean": round(float(np.mean(duration_ratios)), 3),
+        }
+    print(json.dumps({"reference": reference, "similarity": similarity}))
+
+
+def run_child(args: argparse.Namespace, mode: str, profile: str) -> Dict:
+    env = {**os.environ, "INFERENCE_PROFILE": profile, "PRELOAD_SPEAKERS": args.speaker}
+    if args.threads:
+        env["TORCH_INTRAOP_THREADS"] = str(args.threads)
+    if args.interop_threads:
+        env["TORCH_INTEROP_THREADS"] = str(args.interop_threads)
+    command = [sys.executable, os.path.abspath(__file__), *sys.argv[1:], f"--{mode}"]
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    # The model prints while loading, the result is the last line
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", default="fp32,int8", help="The first profile is the similarity reference")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per phrase")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=0, help="Intra-op threads, 0 keeps the torch default")
+    parser.add_argument("--interop-threads", type=int, default=0)
+    parser.add_argument("--speaker", default="Craig Gutsy")
+    parser.add_argument("--language", default="es")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="profile_benchmark", help="Folder for the synthesized audio")
+    parser.add_argument("--run-profile", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--compare", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    profiles = [profile.strip() for profile in args.profiles.split(",") if profile.strip()]
+    if args.run_profile:
+        run_profile(args)
+        return
+    if args.compare:
+        compare(args, profiles)
+        return
+
+    results = {"phrases": len(PHRASES), "runs": args.runs, "speaker": args.speaker, "profiles": []}
+    for profile in profiles:
+        results["profiles"].append(run_child(args, "run-profile", profile))
+    if len(profiles) > 1:
+        results.update(run_child(args, "compare", "fp32"))
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Tuple
+
+# Synthesis threads, each one keeps the cores busy on its own
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", default="1"))
+# Requests allowed to wait for a free worker, further ones get 429
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", default="4"))
+# Retry-After sent before any synthesis time was measured
+INFERENCE_RETRY_AFTER_SECONDS = int(os.getenv("INFERENCE_RETRY_AFTER_SECONDS", default="10"))
+
+
+class InferenceQueueFull(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Inference queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """
+    Runs synthesis in a fixed number of worker threads, off the event loop.
+
+    At most `queue_size` requests wait for a free worker, further ones are
+    rejected right away so callers can back off or go elsewhere.
+    """
+
+    def __init__(self, workers: int = INFERENCE_WORKERS, queue_size: int = INFERENCE_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.total_compute = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self) -> int:
+        return self.pending - self.running
+
+    def retry_after(self) -> int:
+        if not self.completed:
+            return INFERENCE_RETRY_AFTER_SECONDS
+        average_compute = self.total_compute / self.completed
+        return max(1, math.ceil(average_compute * (self.queued + 1) / self.workers))
+
+    async def run(self, function: Callable[..., Any], *args) -> Tuple[Any, Dict[str, float]]:
+        """
+        Runs the function in a worker, returns its result and the wait and compute seconds.
+
+        Raises InferenceQueueFull when too many requests are waiting.
+        """
+        timing = self._admit()
+        future = self._submit(function, args, timing)
+        # A disconnected client cancels the job if it has not started yet
+        result = await asyncio.wrap_future(future)
+        return result, timing
+
+    def stream(self, function: Callable[..., Iterator[Any]], *args) -> Tuple[AsyncIterator[Any], Dict[str, float]]:
+        """
+        Runs a generator function in a worker and relays its items as they are produced.
+
+        Raises InferenceQueueFull right away, before anything is streamed. The
+        generator is stopped once the returned iterator is closed.
+        """
+        timing = self._admit()
+        loop = asyncio.get_running_loop()
+        items = asyncio.Queue()
+        stopped = threading.Event()
+        done = object()
+
+        def produce():
+            for item in function(*args):
+                if stopped.is_set():
+                    break
+                loop.call_soon_threadsafe(items.put_nowait, item)
+
+        future = self._submit(produce, (), timing)
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(items.put_nowait, done))
+
+        async def relay():
+            try:
+                while (item := await items.get()) is not done:
+                    yield item
+                future.result()
+            finally:
+                stopped.set()
+                future.cancel()
+
+        return relay(), timing
+
+    def _admit(self) -> Dict[str, float]:
+        with self._lock:
+            if self.pending >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise InferenceQueueFull(self.retry_after())
+            # Requests waiting ahead of this one
+            queue_depth = self.queued
+            self.pending += 1
+        return {"queue_depth": queue_depth}
+
+    def _submit(self, function: Callable[..., Any], args: Tuple, timing: Dict[str, float]) -> Future:
+        submitted = time.monotonic()
+
+        def job():
+            started = time.monotonic()
+            with self._lock:
+                self.running += 1
+            timing["wait"] = started - submitted
+            try:
+                return function(*args)
+            finally:
+                timing["compute"] = time.monotonic() - started
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                    self.total_wait += timing["wait"]
+                    self.total_compute += timing["compute"]
+
+        def release(_):
+            # Also called for jobs cancelled before they started
+            with self._lock:
+                self.pending -= 1
+
+        future = self.executor.submit(job)
+        future.add_done_callback(release)
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "running": self.running,
+                "queued": self.queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.total_wait / self.completed * 1000, 1) if self.completed else None,
+                "avg_compute_ms": round(self.total_compute / self.completed * 1000, 1) if self.completed else None,
+            }
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+from contextlib import aclosing
+
+import pytest
+
+from inference_pool import INFERENCE_RETRY_AFTER_SECONDS, InferencePool, InferenceQueueFull
+
+
+def test_run_returns_result_and_timing():
+    pool = InferencePool(workers=1, queue_size=1)
+    result, timing = asyncio.run(pool.run(lambda a, b: a + b, 1, 2))
+
+    assert result == 3
+    assert timing["queue_depth"] == 0
+    assert timing["wait"] >= 0 and timing["compute"] >= 0
+    assert pool.stats()["completed"] == 1
+
+
+def test_errors_of_the_function_are_raised():
+    def unknown_speaker():
+        raise KeyError("Nobody")
+
+    with pytest.raises(KeyError):
+        asyncio.run(InferencePool(workers=1, queue_size=0).run(unknown_speaker))
+
+
+def test_requests_beyond_the_queue_are_rejected():
+    pool = InferencePool(workers=1, queue_size=1)
+    release = threading.Event()
+
+    async def run():
+        running = asyncio.ensure_future(pool.run(release.wait))
+        queued = asyncio.ensure_future(pool.run(lambda: "queued"))
+        await asyncio.sleep(0.05)
+        assert pool.stats()["running"] == 1
+        assert pool.stats()["queued"] == 1
+        with pytest.raises(InferenceQueueFull) as rejected:
+            await pool.run(lambda: "rejected")
+        release.set()
+        return rejected.value, await queued, await running
+
+    rejected, (queued, timing), _ = asyncio.run(run())
+    # Nothing was measured yet when the request was turned away
+    assert rejected.retry_after == INFERENCE_RETRY_AFTER_SECONDS
+    assert queued == "queued"
+    # Only the running request was ahead of it, none was waiting
+    assert timing["queue_depth"] == 0
+    assert pool.stats()["rejected"] == 1
+    assert pool.stats()["queued"] == 0
+
+
+def test_retry_after_follows_measured_compute_time():
+    pool = InferencePool(workers=2, queue_size=4)
+    pool.completed = 4
+    pool.total_compute = 12.0
+    pool.pending = 5
+    pool.running = 2
+    # 3 seconds per job, 3 waiting plus this one, 2 workers
+    assert pool.retry_after() == 6
+
+
+def test_stream_relays_items_as_produced():
+    pool = InferencePool(workers=1, queue_size=0)
+
+    def produce(count):
+        yield from range(count)
+
+    async def run():
+        chunks, timing = pool.stream(produce, 3)
+        async with aclosing(chunks):
+            return [chunk async for chunk in chunks], timing
+
+    items, timing = asyncio.run(run())
+    assert items == [0, 1, 2]
+    assert "compute" in timing
+
+
+def test_closing_a_stream_stops_the_generator_and_frees_the_worker():
+    pool = InferencePool(workers=1, queue_size=0)
+    produced = []
+
+    def produce():
+        for item in range(1000):
+            produced.append(item)
+            yield item
+            threading.Event().wait(0.001)
+
+    async def run():
+        chunks, _ = pool.stream(produce)
+        async with aclosing(chunks):
+            async for _ in chunks:
+                break
+        # The worker is free again once the generator noticed
+        for _ in range(100):
+            if not pool.pending:
+                break
+            await asyncio.sleep(0.01)
+        return await pool.run(lambda: "next")
+
+    result, _ = asyncio.run(run())
+    assert result == "next"
+    assert len(produced) < 1000
@@ -2,7 +2,7 @@
 # Token should be placed in token.json { "token": ... }
 
 import os
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.responses import JSONResponse
 import yadisk
 import uvicorn
@@ -96,6 +96,49 @@ async def upload_file(
         print(f"An unexpected error occurred during file upload and publish: {e} {stack_trace_string}")
         raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
 
+@app.post("/upload-stream", summary="Upload and publish a file sent as the request body")
+async def upload_file_stream(request: Request, filename: str):
+    """
+    Uploads the raw request body to Yandex Disk while it is being received,
+    makes it public, and returns its public URL.
+
+    Unlike /upload, the file is never spooled to memory or disk.
+
+    - **filename**: The file name.
+    """
+    yandex_path = f"/{YANDEX_FILE_DIR}/{filename}"
+
+    try:
+        if await disk.exists(yandex_path):
+            raise HTTPException(
+                status_code=409,
+                detail=f"File '{yandex_path}' already exists."
+            )
+
+        # yadisk accepts an async generator function as the source,
+        # the request body can only be read once, so there are no retries
+        await disk.upload(request.stream, yandex_path, overwrite=True, n_retries=0)
+
+        # Make the file public
+        await disk.publish(yandex_path)
+
+        # Obtain public url
+        public_url = await disk.get_download_link(yandex_path)
+
+        if public_url:
+            return JSONResponse(content={
+                "message": "File uploaded and published successfully",
+                "filename": filename,
+                "url": public_url
+            }, status_code=200)
+        else:
+            raise HTTPException(status_code=500, detail="Failed to publish file on Yandex Disk.")
+
+    except Exception as e:
+        stack_trace_string = traceback.format_exc()
+        print(f"An unexpected error occurred during file stream upload and publish: {e} {stack_trace_string}")
+        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {e}")
+
 @app.delete("/delete", summary="Delete a file")
 async def delete_file(filename: str, permanently: bool = True):
     """